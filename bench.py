@@ -0,0 +1,137 @@
+import datetime, timeit
+
+import hug
+import pronotepy
+import server
+from fake_pronote import FakeClient, make_sizes, start_day
+
+print('Micro-benchmark de la sérialisation papillon-python')
+print('orjson :', 'oui' if server.orjson is not None else 'non (pip3 install orjson)')
+
+# faux modèles de pronotepy, avec les attributs lus par l'API (voir fake_pronote.py)
+client = FakeClient(make_sizes(grades=150, news=100, discussions=50, messages=10, lessons=8))
+lessons = client.lessons(start_day, start_day + datetime.timedelta(days=24))
+news = client.information_and_surveys()
+discussions = client.discussions()
+grades = [pronotepy.Grade(grade) for grade in client.post('DernieresNotes', 198, {'Periode': {'N': 'p1'}})['dataSec']['data']['listeDevoirs']['V']]
+
+# les dictionnaires construits à la main, comme le faisaient les routes avant les schémas
+def legacy_lessons(lessons):
+    return [{
+        "id": lesson.id,
+        "num": lesson.num,
+        "subject": {
+            "id": lesson.subject.id if lesson.subject is not None else "0",
+            "name": lesson.subject.name if lesson.subject is not None else "",
+            "groups": lesson.subject.groups if lesson.subject is not None else False
+        },
+        "teachers": lesson.teacher_names,
+        "rooms": lesson.classrooms,
+        "group_names": lesson.group_names,
+        "memo": lesson.memo,
+        "virtual": lesson.virtual_classrooms,
+        "start": lesson.start.strftime("%Y-%m-%d %H:%M"),
+        "end": lesson.end.strftime("%Y-%m-%d %H:%M"),
+        "background_color": lesson.background_color,
+        "status": lesson.status,
+        "is_cancelled": lesson.canceled,
+        "is_outing": lesson.outing,
+        "is_detention": lesson.detention,
+        "is_exempted": lesson.exempted,
+        "is_test": lesson.test,
+    } for lesson in lessons]
+
+def legacy_news(allNews):
+    newsAllData = []
+    for news in allNews:
+        attachments = []
+        if news.attachments is not None:
+            for attachment in news.attachments:
+                attachments.append({
+                    "id": attachment.id,
+                    "name": attachment.name,
+                    "url": attachment.url,
+                    "type": attachment.type
+                })
+        newsAllData.append({
+            "id": news.id,
+            "title": news.title,
+            "date": news.creation_date.strftime("%Y-%m-%d %H:%M"),
+            "category": news.category,
+            "read": news.read,
+            "survey": news.survey,
+            "anonymous_survey": news.anonymous_response,
+            "author": news.author,
+            "content": news.content,
+            "attachments": attachments,
+            "html_content": news._raw_content
+        })
+    return newsAllData
+
+def legacy_discussions(allDiscussions):
+    discussionsAllData = []
+    for discussion in allDiscussions:
+        messages = []
+        for message in discussion.messages:
+            messages.append({
+                "id": message.id,
+                "content": message.content,
+                "author": message.author,
+                "date": message.date.strftime("%Y-%m-%d %H:%M") if message.date is not None else None,
+                "seen": message.seen
+            })
+        discussionsAllData.append({
+            "id": discussion.id,
+            "subject": discussion.subject,
+            "creator": discussion.creator,
+            "participants": discussion.participants,
+            "date": discussion.date.strftime("%Y-%m-%d %H:%M") if discussion.date is not None else None,
+            "unread": discussion.unread,
+            "closed": discussion.close,
+            "replyable": discussion.replyable,
+            "messages": messages,
+        })
+    return discussionsAllData
+
+get_grade_state = getattr(server, '__get_grade_state')
+transform_to_number = getattr(server, '__transform_to_number')
+
+def legacy_grades(allGrades):
+    return [{
+        "id": grade.id,
+        "subject": {
+            "id": grade.subject.id,
+            "name": grade.subject.name,
+            "groups": grade.subject.groups,
+        },
+        "date": grade.date.strftime("%Y-%m-%d %H:%M"),
+        "description": grade.comment,
+        "is_bonus": grade.is_bonus,
+        "is_optional": grade.is_optionnal,
+        "is_out_of_20": grade.is_out_of_20,
+        "grade": {
+            "value": transform_to_number(get_grade_state(grade.grade)),
+            "out_of": transform_to_number(grade.out_of),
+            "coefficient": transform_to_number(grade.coefficient),
+            "average": transform_to_number(get_grade_state(grade.average)),
+            "max": transform_to_number(get_grade_state(grade.max)),
+            "min": transform_to_number(get_grade_state(grade.min)),
+            "significant": get_grade_state(grade.grade, True),
+        }
+    } for grade in allGrades]
+
+cases = [
+    ('/timetable', lessons, legacy_lessons, server.lesson_schema),
+    ('/news', news, legacy_news, server.news_schema),
+    ('/discussions', discussions, legacy_discussions, server.discussion_schema),
+    ('/grades', grades, legacy_grades, server.grade_schema),
+]
+
+number = 200
+print(f'{number} réponses par mesure, en µs par réponse (sérialisation + encodage JSON)')
+for route, models, legacy, schema in cases:
+    assert legacy(models) == schema.dump_many(models)
+
+    before = min(timeit.repeat(lambda: hug.output_format.json(legacy(models)), number=number, repeat=5)) / number
+    after = min(timeit.repeat(lambda: server.json_output(schema.dump_many(models)), number=number, repeat=5)) / number
+    print(f'{route:<14} avant {before * 1e6:8.0f} µs   après {after * 1e6:8.0f} µs   x{before / after:.1f}')
@@ -0,0 +1,223 @@
+"""
+Faux client Pronote, déterministe et configurable, utilisé par test.py et bench.py pour mesurer le serveur hors ligne.
+"""
+import datetime, time
+from types import SimpleNamespace
+
+import pronotepy
+
+start_day = datetime.date(2023, 1, 9) # un lundi, pour que les données ne dépendent pas de la date du jour
+
+
+def pronote_date(value):
+    return value.strftime('%d/%m/%Y')
+
+def pronote_datetime(value):
+    return value.strftime('%d/%m/%Y %H:%M:%S')
+
+def subject_json(i):
+    return {'N': f's{i % 12}', 'L': f'Matière {i % 12}', 'estServiceGroupe': False}
+
+def subject(i):
+    return SimpleNamespace(id=f's{i % 12}', name=f'Matière {i % 12}', groups=False)
+
+def attachment(i):
+    return SimpleNamespace(id=f'f{i}', name='document.pdf', url='https://example.com/document.pdf', type=1)
+
+
+class FakeDiscussion:
+    def __init__(self, i, messages):
+        self.id = f'd{i}'
+        self.subject = f'Discussion {i}'
+        self.creator = 'M. Martin'
+        self.participants = ['M. Martin', 'L. Martin']
+        self.date = datetime.datetime.combine(start_day, datetime.time(8)) - datetime.timedelta(hours=i)
+        self.unread = i % 3
+        self.close = False
+        self.replyable = True
+        self.messages = [SimpleNamespace(
+            id=f'm{i}-{j}', content='Bonjour ' * 20, author='M. Martin' if j % 2 else 'L. Martin',
+            date=self.date + datetime.timedelta(minutes=j), seen=j < messages - 1
+        ) for j in range(messages)]
+
+    def mark_as(self, read):
+        self.unread = 0 if read else 1
+
+    def reply(self, content):
+        pass
+
+    def delete(self):
+        # les données restent identiques d'un appel à l'autre
+        pass
+
+
+class FakeHomework:
+    def __init__(self, i):
+        self.id = f'h{i}'
+        self.subject = subject(i)
+        self.description = 'Exercices 1 à 4 page 52'
+        self.background_color = '#08BE88'
+        self.done = False
+        self.date = start_day + datetime.timedelta(days=i % 28)
+        self.files = [attachment(i)] if i % 4 == 0 else []
+
+    def set_done(self, status):
+        self.done = status
+
+
+class FakeClient:
+    """
+    Remplace pronotepy.Client : les méthodes de haut niveau renvoient des modèles construits à l'avance,
+    et post() renvoie les réponses brutes de Pronote lues par le serveur (notes, vie scolaire, évaluations),
+    qui sont donc décodées par pronotepy comme avec un vrai client.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.logged_in = True
+        self.communication = SimpleNamespace(session=SimpleNamespace(close=lambda: None))
+        self.info = SimpleNamespace(
+            name='MARTIN Léa', class_name='3A', establishment='Collège Papillon', phone='+33600000000',
+            email='lea.martin@example.com', address=['1 rue des Papillons', '35000 Rennes'], ine_number='000000000AA',
+            profile_picture=None, delegue=False
+        )
+        self.periods = [pronotepy.Period(self, {
+            'N': f'p{i}', 'L': name, 'dateDebut': {'V': start}, 'dateFin': {'V': end}
+        }) for i, (name, start, end) in enumerate([
+            ('Trimestre 1', '01/09/2022', '30/11/2022'),
+            ('Trimestre 2', '01/12/2022', '28/02/2023'),
+            ('Trimestre 3', '01/03/2023', '07/07/2023'),
+            ('Année continue', '01/09/2022', '07/07/2023'),
+        ])]
+        self.current_period = self.periods[1]
+
+        self._homework = [FakeHomework(i) for i in range(sizes.homework)]
+        self._discussions = [FakeDiscussion(i, sizes.messages) for i in range(sizes.discussions)]
+        self._news = [SimpleNamespace(
+            id=f'n{i}', title=f'Information {i}', creation_date=datetime.datetime.combine(start_day, datetime.time(9)) - datetime.timedelta(days=i),
+            category='Information', read=i % 2 == 0, survey=False, anonymous_response=False, author='Direction',
+            content='Lorem ipsum ' * 40, attachments=[attachment(i)] if i % 5 == 0 else [], _raw_content='<p>' + 'Lorem ipsum ' * 40 + '</p>'
+        ) for i in range(sizes.news)]
+        self._recipients = [SimpleNamespace(
+            id=f'r{i}', name=f'Personnel {i}', type='teacher' if i % 3 else 'personal', email=None,
+            functions=[f'Matière {i % 12}'], with_discussion=i % 10 != 0
+        ) for i in range(sizes.recipients)]
+
+    def lessons(self, date_from, date_to=None):
+        lessons = []
+        day = date_from
+        while day <= (date_to or date_from):
+            for i in range(self.sizes.lessons):
+                start = datetime.datetime.combine(day, datetime.time(8 + i))
+                lessons.append(SimpleNamespace(
+                    id=f'l{day:%Y%m%d}-{i}', num=i, subject=subject(i), teacher_names=['M. Martin'], classrooms=['B12'],
+                    group_names=[], memo=None, virtual_classrooms=[], start=start, end=start + datetime.timedelta(hours=1),
+                    background_color='#08BE88', status=None, canceled=False, outing=False, detention=False, exempted=False,
+                    test=i == 3, content=[SimpleNamespace(
+                        title='Chapitre 2', description='Cours et exercices', category='Cours', files=[attachment(i)]
+                    )]
+                ))
+            day += datetime.timedelta(days=1)
+        return lessons
+
+    def homework(self, date_from, date_to=None):
+        return [homework for homework in self._homework if date_from <= homework.date <= (date_to or homework.date)]
+
+    def information_and_surveys(self):
+        return list(self._news)
+
+    def discussions(self):
+        return list(self._discussions)
+
+    def get_recipients(self):
+        return list(self._recipients)
+
+    def new_discussion(self, subject, content, recipients):
+        pass
+
+    def menus(self, date_from, date_to=None):
+        food = [SimpleNamespace(name='Carottes râpées', labels=[SimpleNamespace(id='bio', name='Bio', color='#4CAF50')])]
+        menus = []
+        day = date_from
+        while day <= (date_to or date_from):
+            menus.append(SimpleNamespace(
+                id=f'menu{day:%Y%m%d}', name=None, date=day, is_lunch=True, is_dinner=False,
+                first_meal=food, dessert=food, cheese=None, other_meal=None, side_meal=food, main_meal=food
+            ))
+            day += datetime.timedelta(days=1)
+        return menus
+
+    def export_ical(self):
+        return 'https://example.com/ical'
+
+    def post(self, function_name, onglet=None, data=None):
+        if function_name == 'DernieresNotes':
+            period = data['Periode']['N']
+            return {'dataSec': {'data': {
+                'listeDevoirs': {'V': [{
+                    'N': f'g{period}-{i}', 'note': {'V': f'{i % 20},5'}, 'bareme': {'V': '20'}, 'baremeParDefaut': {'V': '20'},
+                    'date': {'V': pronote_date(start_day - datetime.timedelta(days=i % 90))}, 'service': {'V': subject_json(i)},
+                    'periode': {'V': {'N': period}}, 'moyenne': {'V': '12,25'}, 'noteMax': {'V': '19'}, 'noteMin': {'V': '4'},
+                    'coefficient': '1', 'commentaire': 'Contrôle', 'estBonus': False, 'estFacultatif': False, 'estRamenerSur20': False
+                } for i in range(self.sizes.grades)]},
+                'listeServices': {'V': [{
+                    **subject_json(i), 'moyEleve': {'V': '14,5'}, 'baremeMoyEleve': {'V': '20'}, 'moyClasse': {'V': '12'},
+                    'moyMin': {'V': '5'}, 'moyMax': {'V': '18'}, 'couleur': '#08BE88'
+                } for i in range(12)]},
+                'moyGenerale': {'V': '14,2'},
+                'moyGeneraleClasse': {'V': '12'},
+            }}}
+        if function_name == 'PagePresence':
+            period = data['periode']['N']
+            items = []
+            for i in range(self.sizes.absences):
+                day = datetime.datetime.combine(start_day, datetime.time(8)) - datetime.timedelta(days=i)
+                items.append({'G': 13, 'N': f'a{period}-{i}', 'dateDebut': {'V': pronote_datetime(day)}, 'dateFin': {'V': pronote_datetime(day + datetime.timedelta(hours=2))},
+                    'justifie': i % 2 == 0, 'NbrHeures': '2h00', 'NbrJours': 0, 'listeMotifs': {'V': [{'L': 'Maladie'}]}})
+                items.append({'G': 14, 'N': f'r{period}-{i}', 'date': {'V': pronote_datetime(day)}, 'duree': 10, 'justifie': False,
+                    'justification': 'Transport', 'listeMotifs': {'V': []}})
+                items.append({'G': 41, 'N': f'u{period}-{i}', 'dateDemande': {'V': pronote_date(day)}, 'horsCours': True, 'estUneExclusion': False,
+                    'travailAFaire': 'Recopier le règlement', 'documentsTAF': {'V': []}, 'circonstances': 'Bavardages', 'documentsCirconstances': {'V': []},
+                    'nature': {'V': {'L': 'Retenue'}}, 'listeMotifs': {'V': [{'L': 'Bavardage'}]}, 'demandeur': {'V': {'L': 'M. Martin'}},
+                    'estProgrammable': False, 'duree': 60})
+            return {'dataSec': {'data': {'listeAbsences': {'V': items}}}}
+        if function_name == 'DernieresEvaluations':
+            return {'dataSec': {'data': {'listeEvaluations': {'V': [{
+                'N': f'e{i}', 'L': f'Évaluation {i}', 'individu': {'V': {'L': 'M. Martin'}}, 'coefficient': 1, 'descriptif': '',
+                'matiere': {'V': subject_json(i)}, 'listePaliers': {'V': [{'L': 'Palier 3'}]},
+                'listeNiveauxDAcquisitions': {'V': [{
+                    'N': f'e{i}-{j}', 'L': 'Très bonne maîtrise', 'abbreviation': 'A+', 'coefficient': 1, 'ordre': j,
+                    'domaine': {'V': {'N': 'dom', 'L': 'Domaine'}}, 'item': {'V': {'N': 'it', 'L': 'Compétence'}},
+                    'pilier': {'V': {'N': 'pil', 'L': 'Pilier', 'strPrefixes': ''}}
+                } for j in range(3)]},
+                'date': {'V': pronote_date(start_day - datetime.timedelta(days=i % 90))}
+            } for i in range(self.sizes.evaluations)]}}}}
+        raise NotImplementedError(function_name)
+
+
+def install_client(server, sizes, token='bench'):
+    """Injecte un faux client dans saved_clients, dans l'état où /generatetoken le laisse."""
+    client = FakeClient(sizes)
+    get_current_period = getattr(server, '__get_current_period')
+    client.calculated_period = get_current_period(client)
+    client.activated_period = get_current_period(client, False, None, True)
+    server.saved_clients[token] = {'client': client, 'last_interaction': time.time()}
+    return client
+
+
+# taille des données du faux client : valeur par défaut et description
+sizes = {
+    'grades': (500, 'notes par période'),
+    'evaluations': (100, 'évaluations par période'),
+    'absences': (50, 'absences, retards et punitions par période'),
+    'discussions': (200, 'discussions'),
+    'messages': (10, 'messages par discussion'),
+    'recipients': (1000, 'destinataires de l\'annuaire'),
+    'news': (100, 'actualités'),
+    'homework': (200, 'devoirs, répartis sur 4 semaines'),
+    'lessons': (8, 'cours par jour'),
+}
+
+def make_sizes(**overrides):
+    """Retourne la taille des données du faux client, par défaut sauf pour les valeurs données."""
+    return SimpleNamespace(**{name: overrides.get(name, default) for name, (default, help) in sizes.items()})
@@ -8,6 +8,25 @@ import secrets
 import falcon
 import json
 import socket
+import threading
+import collections
+import heapq
+import os
+import pickle
+import zlib
+import sqlite3
+import urllib.parse
+import concurrent.futures
+import hmac
+import hashlib
+import weakref
+import bisect
+import functools
+import operator
+import gzip
+import contextlib
+import sys
+import abc
 
 
 import resource
@@ -19,20 +38,216 @@ from pronotepy.ent import *
 API_VERSION = open('VERSION', 'r').read().strip()
 CAS_LIST = json.load(open('cas_list.json', 'r', encoding='utf8'))
 
+# métriques au format texte de Prometheus, exportées par /metrics
+metrics = [] # toutes les métriques, dans l'ordre de l'export
+
+class Metric:
+	"""
+	Une métrique Prometheus, avec une série par combinaison de valeurs de ses labels.
+	
+	Args:
+		name (str): Le nom de la métrique
+		kind (str): "counter", "gauge" ou "histogram"
+		help (str): La description de la métrique
+		labels (tuple[str], optional): Les noms des labels
+		buckets (tuple[float], optional): Les bornes des intervalles d'un histogramme, croissantes
+		collect (Callable, optional): Pour les valeurs déjà comptées ailleurs : fonction appelée à chaque export, qui retourne dict[tuple, float] (valeurs des labels -> valeur)
+	"""
+
+	def __init__(self, name: str, kind: str, help: str, labels: tuple = (), buckets: tuple = (), collect = None):
+		self.name = name
+		self.kind = kind
+		self.help = help
+		self.labels = labels
+		self.buckets = buckets
+		self.collect = collect
+		self.series = {}
+		self.lock = threading.Lock()
+		metrics.append(self)
+
+	def inc(self, *labels, value: float = 1):
+		"""Incrémente la série d'un compteur."""
+		with self.lock:
+			self.series[labels] = self.series.get(labels, 0) + value
+
+	def observe(self, *labels, value: float):
+		"""Ajoute une mesure à la série d'un histogramme."""
+		with self.lock:
+			series = self.series.get(labels)
+			if series is None:
+				# une case par intervalle, +Inf, puis la somme des mesures
+				series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+			series[bisect.bisect_left(self.buckets, value)] += 1
+			series[-1] += value
+
+	def format_labels(self, values: tuple, extra: str = '') -> str:
+		"""Formate les labels d'une série, suivis d'un label déjà formaté (le, pour les intervalles d'un histogramme)."""
+		pairs = []
+		for name, value in zip(self.labels, values):
+			value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+			pairs.append(f'{name}="{value}"')
+		if extra:
+			pairs.append(extra)
+		return '{' + ','.join(pairs) + '}' if pairs else ''
+
+	def render(self) -> list[str]:
+		"""Retourne les lignes de la métrique au format texte de Prometheus."""
+		lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+		if self.collect is not None:
+			series = self.collect()
+		else:
+			with self.lock:
+				series = {labels: list(value) if isinstance(value, list) else value for labels, value in self.series.items()}
+		
+		for labels, value in series.items():
+			if self.kind != 'histogram':
+				lines.append(f'{self.name}{self.format_labels(labels)} {value}')
+				continue
+			count = 0
+			for bound, bucketCount in zip(self.buckets + (float('inf'),), value):
+				count += bucketCount
+				le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+				lines.append(f'{self.name}_bucket{self.format_labels(labels, le)} {count}')
+			lines.append(f'{self.name}_sum{self.format_labels(labels)} {value[-1]}')
+			lines.append(f'{self.name}_count{self.format_labels(labels)} {count}')
+		return lines
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # bornes en sec des histogrammes de latence
+
+http_requests = Metric('papillon_http_requests_total', 'counter', 'Requêtes HTTP reçues, par route, méthode et code de réponse', ('route', 'method', 'status'))
+http_request_duration = Metric('papillon_http_request_duration_seconds', 'histogram', 'Durée de traitement des requêtes HTTP, par route', ('route',), latency_buckets)
+upstream_duration = Metric('papillon_upstream_request_duration_seconds', 'histogram', 'Durée des appels à Pronote, par fonction Pronote', ('function',), latency_buckets)
+upstream_errors = Metric('papillon_upstream_errors_total', 'counter', 'Appels à Pronote en erreur, par fonction Pronote', ('function',))
+login_wait_duration = Metric('papillon_login_queue_wait_seconds', 'histogram', "Temps d'attente des connexions à Pronote dans la file, de leur demande à leur début", buckets=latency_buckets)
+login_results = Metric('papillon_logins_total', 'counter', 'Connexions par /generatetoken, par ENT et résultat (success, failure, reused, queue_full)', ('ent', 'result'))
+
+# détail de la durée de chaque requête par étape, renvoyé dans l'en-tête Server-Timing
+server_timing = True # si True, les réponses ont un en-tête Server-Timing avec la durée de chaque étape
+timing_log_threshold = os.environ.get('PAPILLON_TIMING_LOG') # si défini, durée en ms à partir de laquelle le détail d'une requête est affiché en JSON (0 : toutes les requêtes)
+
+class RequestTimings:
+	"""
+	Les durées des étapes d'une requête (session, appels à Pronote, sérialisation, encodage...).
+	Chaque étape ne compte que son propre temps : la durée d'une étape imbriquée dans une autre (un appel à Pronote
+	pendant la sérialisation d'une discussion) est retirée de l'étape qui la contient.
+	
+	Attributes:
+		start (float): Le début de la requête (time.perf_counter())
+		durations (dict[str, float]): La durée en sec de chaque étape, dans l'ordre de leur première mesure
+		counts (dict[str, int]): Le nombre de mesures de chaque étape
+		stack (list[list]): Les étapes en cours, sous la forme [nom, début, durée des étapes imbriquées]
+	"""
+
+	def __init__(self):
+		self.start = time.perf_counter()
+		self.durations = {}
+		self.counts = {}
+		self.stack = []
+
+	@contextlib.contextmanager
+	def measure(self, name: str):
+		"""Mesure une étape, le temps du bloc with."""
+		frame = [name, time.perf_counter(), 0.0]
+		self.stack.append(frame)
+		try:
+			yield
+		finally:
+			self.stack.pop()
+			elapsed = time.perf_counter() - frame[1]
+			self.durations[name] = self.durations.get(name, 0.0) + elapsed - frame[2]
+			self.counts[name] = self.counts.get(name, 0) + 1
+			if self.stack:
+				self.stack[-1][2] += elapsed
+
+	def header(self, total: float) -> str:
+		"""Retourne la valeur de l'en-tête Server-Timing, en ms, avec le temps non attribué (app) et la durée totale."""
+		entries = []
+		for name, duration in self.durations.items():
+			count = self.counts[name]
+			desc = f';desc="{count} appels"' if count > 1 else ''
+			entries.append(f'{name};dur={duration * 1000:.3f}{desc}')
+		entries.append(f'app;dur={max(total - sum(self.durations.values()), 0) * 1000:.3f}')
+		entries.append(f'total;dur={total * 1000:.3f}')
+		return ', '.join(entries)
+
+request_timings = threading.local() # current -> RequestTimings de la requête traitée par ce thread
+
+@contextlib.contextmanager
+def timed(name: str):
+	"""
+	Mesure une étape de la requête en cours, utilisable avec with ou comme décorateur.
+	Ne fait rien hors d'une requête (threads de /batch, préchargement, /events).
+	"""
+	timings = getattr(request_timings, 'current', None)
+	if timings is None:
+		yield
+		return
+	with timings.measure(name):
+		yield
+
+# durée des requêtes : le début est noté par request_timing, la fin par record_request, exécuté après tous les autres middlewares de réponse
+@hug.request_middleware()
+def request_timing(request, response):
+	request_timings.current = RequestTimings()
+	request.env['papillon.start'] = request_timings.current.start
+
+@hug.response_middleware()
+def record_request(request, response, resource):
+	timings = request_timings.__dict__.pop('current', None)
+	start = request.env.get('papillon.start')
+	if start is None:
+		return
+	total = time.perf_counter() - start
+	route = request.uri_template or 'unknown'
+	status = str(response.status).split(' ')[0]
+	http_requests.inc(route, request.method, status)
+	http_request_duration.observe(route, value=total)
+
+	if timings is None:
+		return
+	if server_timing:
+		response.set_header('Server-Timing', timings.header(total))
+	if timing_log_threshold is not None and total * 1000 >= float(timing_log_threshold):
+		print(json.dumps({
+			"event": "request",
+			"method": request.method,
+			"route": route,
+			"status": int(status),
+			"duration_ms": round(total * 1000, 1),
+			"timings": {name: {"ms": round(duration * 1000, 1), "count": timings.counts[name]} for name, duration in timings.durations.items()},
+		}), flush=True)
+
+# durée des appels à Pronote : toutes les requêtes de pronotepy (connexion comprise) passent par _Communication.post
+__communication_post = pronotepy.pronoteAPI._Communication.post
+
+def __timed_communication_post(self, function_name: str, *args, **kwargs):
+	start = time.perf_counter()
+	try:
+		with timed('upstream'):
+			return __communication_post(self, function_name, *args, **kwargs)
+	except Exception:
+		upstream_errors.inc(function_name)
+		raise
+	finally:
+		upstream_duration.observe(function_name, value=time.perf_counter() - start)
+
+pronotepy.pronoteAPI._Communication.post = __timed_communication_post
+
 # ajouter les CORS sur toutes les routes
 @hug.response_middleware()
 def CORS(request, response, resource):
 	response.set_header('Access-Control-Allow-Origin', '*')
+	response.set_header('Timing-Allow-Origin', '*')
 	response.set_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
 	response.set_header(
 		'Access-Control-Allow-Headers',
 		'Authorization,Keep-Alive,User-Agent,'
-		'If-Modified-Since,Cache-Control,Content-Type'
+		'If-Modified-Since,If-None-Match,Cache-Control,Content-Type'
 	)
 	response.set_header(
 		'Access-Control-Expose-Headers',
 		'Authorization,Keep-Alive,User-Agent,'
-		'If-Modified-Since,Cache-Control,Content-Type'
+		'If-Modified-Since,Cache-Control,Content-Type,ETag,X-Sync-Cursor,Server-Timing'
 	)
 	if request.method == 'OPTIONS':
 		response.set_header('Access-Control-Max-Age', 1728000)
@@ -40,6 +255,288 @@ def CORS(request, response, resource):
 		response.set_header('Content-Length', 0)
 		response.status_code = hug.HTTP_204
 
+# compression des réponses, selon l'en-tête Accept-Encoding du client
+try:
+	import brotli
+except ImportError:
+	brotli = None # optionnel (pip3 install brotli) : encodage br
+try:
+	import zstandard
+except ImportError:
+	zstandard = None # optionnel (pip3 install zstandard) : encodage zstd
+
+compression_min_size = 1024 # taille en octets à partir de laquelle les réponses sont compressées
+compression_level = int(os.environ.get('PAPILLON_COMPRESSION_LEVEL', 6)) # niveau de compression, de 1 (rapide) à 9 (compact)
+
+# encodages proposés, par ordre de préférence
+compressors = {}
+if brotli is not None:
+	compressors['br'] = lambda data: brotli.compress(data, quality=compression_level)
+if zstandard is not None:
+	compressors['zstd'] = lambda data: zstandard.ZstdCompressor(level=compression_level).compress(data)
+compressors['gzip'] = lambda data: gzip.compress(data, compresslevel=compression_level, mtime=0)
+
+class CompressedResponses:
+	"""
+	Garde les réponses déjà compressées, par ETag et encodage : une réponse servie depuis le cache n'est compressée qu'une fois.
+	
+	Args:
+		max_bytes (int): La taille totale maximale des réponses compressées gardées
+	"""
+
+	def __init__(self, max_bytes: int):
+		self.max_bytes = max_bytes
+		self.size = 0
+		self.entries = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, etag: str, encoding: str) -> bytes|None:
+		with self.lock:
+			data = self.entries.get((etag, encoding))
+			if data is not None:
+				self.entries.move_to_end((etag, encoding))
+			return data
+
+	def set(self, etag: str, encoding: str, data: bytes):
+		with self.lock:
+			if (etag, encoding) in self.entries:
+				return
+			self.entries[(etag, encoding)] = data
+			self.size += len(data)
+			while self.size > self.max_bytes:
+				_, evicted = self.entries.popitem(last=False)
+				self.size -= len(evicted)
+
+compressed_responses_max_bytes = 32 * 1024 * 1024 # taille totale maximale des réponses compressées gardées
+compressed_responses = CompressedResponses(compressed_responses_max_bytes)
+cached_bodies = threading.local() # cached -> True si la réponse de la requête traitée par ce thread vient de response_cache (voir __fetch)
+
+def __accepted_encoding(header: str|None) -> str|None:
+	"""
+	Choisit l'encodage de la réponse parmi ceux acceptés par le client.
+	
+	Args:
+		header (str|None): L'en-tête Accept-Encoding de la requête
+		
+	Returns:
+		str|None: L'encodage le mieux noté par le client (à égalité, celui que le serveur préfère), None pour ne pas compresser.
+	"""
+	
+	if not header:
+		return None
+	
+	accepted = {}
+	for part in header.split(','):
+		name, _, params = part.partition(';')
+		quality = 1.0
+		params = params.strip()
+		if params.startswith('q='):
+			try:
+				quality = float(params[2:])
+			except ValueError:
+				quality = 0.0
+		accepted[name.strip().lower()] = quality
+	
+	best, bestQuality = None, 0.0
+	for encoding in compressors:
+		quality = accepted.get(encoding, accepted.get('*', 0.0))
+		if quality > bestQuality:
+			best, bestQuality = encoding, quality
+	return best
+
+# enregistré avant conditional_get pour être exécuté après (hug exécute les middlewares de réponse dans l'ordre inverse), une fois l'ETag calculé
+@hug.response_middleware()
+def compress_response(request, response, resource):
+	# seules les réponses du cache reviennent à l'identique : les autres (erreurs, /metrics...) ne sont pas gardées compressées
+	from_cache = cached_bodies.__dict__.pop('cached', False)
+	data = response.data
+	if not isinstance(data, bytes) or len(data) < compression_min_size or response.get_header('Content-Encoding'):
+		return
+	
+	response.append_header('Vary', 'Accept-Encoding')
+	encoding = __accepted_encoding(request.get_header('Accept-Encoding'))
+	if encoding is None:
+		return
+	
+	etag = response.get_header('ETag') if from_cache else None
+	compressed = compressed_responses.get(etag, encoding) if etag else None
+	if compressed is None:
+		with timed('compress'):
+			compressed = compressors[encoding](data)
+		if etag:
+			compressed_responses.set(etag, encoding, compressed)
+	
+	if len(compressed) < len(data):
+		response.data = compressed
+		response.set_header('Content-Encoding', encoding)
+
+# réponses conditionnelles : le client qui a déjà la réponse reçoit un 304 sans contenu
+def __etag(body: bytes) -> str:
+	"""Retourne l'étiquette (sans guillemets) d'une réponse encodée en JSON."""
+	return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+@hug.response_middleware()
+def conditional_get(request, response, resource):
+	if request.method != 'GET' or response.status != falcon.HTTP_200 or not isinstance(response.data, bytes):
+		return
+
+	# ETag faible : il désigne le contenu JSON, quel que soit l'encodage de transfert
+	tag = __etag(response.data)
+	response.set_header('ETag', f'W/"{tag}"')
+	response.set_header('Cache-Control', 'private, no-cache')
+
+	ifNoneMatch = request.if_none_match
+	if ifNoneMatch and (tag in ifNoneMatch or '*' in ifNoneMatch):
+		response.status = falcon.HTTP_304
+		response.data = None
+		response.delete_header('Content-Type')
+
+# sérialisation des réponses
+date_format = "%Y-%m-%d %H:%M" # le format des dates renvoyées par l'API
+day_format = "%Y-%m-%d" # le format des jours renvoyés par l'API
+
+@functools.lru_cache(maxsize=8192)
+def __format_date(value: datetime.date, fmt: str) -> str:
+	"""Formate une date ; les mêmes dates reviennent souvent (cours, devoirs, messages) et ne sont formatées qu'une fois."""
+	return value.strftime(fmt)
+
+@functools.lru_cache(maxsize=4096)
+def __subject_data(id: str, name: str, groups: bool) -> dict:
+	"""Retourne le dictionnaire d'une matière, le même objet pour toutes les réponses qui la contiennent. Il ne doit pas être modifié."""
+	return {
+		"id": id,
+		"name": name,
+		"groups": groups,
+	}
+
+class Schema:
+	"""
+	Décrit comment transformer un modèle de pronotepy (cours, devoir, note...) en dictionnaire pour les réponses de l'API.
+	
+	Args:
+		fields (dict[str, str|Callable]): Nom du champ dans la réponse -> nom de l'attribut du modèle, ou fonction qui reçoit le modèle et retourne la valeur
+	"""
+
+	projections_max = 64 # nombre maximal de projections gardées par schéma
+
+	def __init__(self, fields: dict):
+		self.fields = tuple((key, operator.attrgetter(field) if isinstance(field, str) else field) for key, field in fields.items())
+		self.names = frozenset(fields)
+		self.projections = {}
+
+	def project(self, fields: str|None = None, exclude: str|None = None) -> 'Schema':
+		"""
+		Retourne un schéma limité à certains champs : les champs retirés ne sont jamais construits.
+		
+		Args:
+			fields (str|None): Les champs à garder, séparés par des virgules. Tous si None.
+			exclude (str|None): Les champs à retirer, séparés par des virgules
+			
+		Returns:
+			Schema: Le schéma limité, ce schéma si rien n'est retiré. Les noms de champs inconnus sont ignorés.
+		"""
+		
+		if fields is None and exclude is None:
+			return self
+		
+		kept = self.names if fields is None else self.names & {field.strip() for field in fields.split(',')}
+		if exclude is not None:
+			kept = kept - {field.strip() for field in exclude.split(',')}
+		
+		projected = self.projections.get(kept)
+		if projected is None:
+			projected = Schema({key: get for key, get in self.fields if key in kept})
+			if len(self.projections) < self.projections_max:
+				self.projections[kept] = projected
+		return projected
+
+	def dump(self, obj) -> dict:
+		"""Transforme un modèle en dictionnaire."""
+		return {key: get(obj) for key, get in self.fields}
+
+	def dump_many(self, objs) -> list[dict]:
+		"""Transforme une liste de modèles en liste de dictionnaires, mesuré comme l'étape serialize de la requête."""
+		with timed('serialize'):
+			return self.dump_list(objs)
+
+	def dump_list(self, objs) -> list[dict]:
+		"""Comme dump_many, sans mesure : pour les listes imbriquées, déjà comptées dans la sérialisation de leur parent."""
+		fields = self.fields
+		return [{key: get(obj) for key, get in fields} for obj in objs]
+
+def __projection(schema: Schema, fields: str|None, exclude: str|None) -> tuple[Schema, dict]:
+	"""
+	Applique les paramètres fields et exclude d'une requête au schéma de ses éléments.
+	
+	Args:
+		schema (Schema): Le schéma des éléments de la réponse
+		fields (str|None): Les champs à garder, séparés par des virgules
+		exclude (str|None): Les champs à retirer, séparés par des virgules
+		
+	Returns:
+		tuple[Schema, dict]: Le schéma limité, et les paramètres à ajouter à la clé de cache de la réponse.
+	"""
+	
+	params = {}
+	if fields is not None:
+		params['fields'] = fields
+	if exclude is not None:
+		params['exclude'] = exclude
+	return schema.project(fields, exclude), params
+
+def __date_field(attr: str, fmt: str = date_format):
+	"""Champ d'un schéma : la date de l'attribut formatée, None si elle est absente."""
+	get = operator.attrgetter(attr)
+	def field(obj):
+		value = get(obj)
+		return __format_date(value, fmt) if value is not None else None
+	return field
+
+def __subject_field(attr: str = 'subject'):
+	"""Champ d'un schéma : la matière de l'attribut, une matière vide s'il n'y en a pas."""
+	get = operator.attrgetter(attr)
+	def field(obj):
+		subject = get(obj)
+		if subject is None:
+			return __subject_data("0", "", False)
+		return __subject_data(subject.id, subject.name, subject.groups)
+	return field
+
+def __list_field(attr: str, schema: Schema, keep_none: bool = False):
+	"""Champ d'un schéma : la liste de l'attribut transformée avec un autre schéma. Une liste absente donne [], ou None avec keep_none."""
+	get = operator.attrgetter(attr)
+	def field(obj):
+		values = get(obj)
+		if values is None:
+			return None if keep_none else []
+		return schema.dump_list(values)
+	return field
+
+def __object_field(schema: Schema):
+	"""Champ d'un schéma : un sous-dictionnaire construit à partir du même modèle."""
+	return schema.dump
+
+try:
+	import orjson
+except ImportError:
+	orjson = None # optionnel (pip3 install orjson) : encode les réponses plus rapidement
+
+def __encode_json(content, request=None, response=None) -> bytes:
+	"""Encode en JSON, directement en bytes avec orjson s'il est installé, sinon avec l'encodeur de hug."""
+	if orjson is not None and not hasattr(content, 'read'):
+		try:
+			return orjson.dumps(content)
+		except TypeError:
+			# types que seul l'encodeur de hug connaît (set, Decimal...)
+			pass
+	return hug.output_format.json(content, request, response)
+
+@hug.default_output_format(content_type='application/json; charset=utf-8')
+def json_output(content, request=None, response=None):
+	"""Encode les réponses en JSON, mesuré comme l'étape encode de la requête."""
+	with timed('encode'):
+		return __encode_json(content, request, response)
+
 # système de tokens
 saved_clients = {}
 """
@@ -47,9 +544,12 @@ saved_clients ->
 	token ->
 		client -> instance de pronotepy.Client
 		last_interaction -> int (provenant de time.time(), entier représentant le temps depuis la dernière intéraction avec le client)
+		version -> int (seulement avec un stockage partagé, la version du client sérialisé dont provient cette instance)
+		login_key -> str (seulement pour les connexions par identifiants, la clé du client dans login_index)
 """
 client_timeout_threshold = 300 # le temps en sec avant qu'un jeton ne soit rendu invalide
 
+@timed('session')
 def get_client(token: str) -> tuple[str, pronotepy.Client|None]:
 	"""Retourne le client Pronote associé au jeton.
 
@@ -63,18 +563,1015 @@ def get_client(token: str) -> tuple[str, pronotepy.Client|None]:
 			pronotepy.Client|None: une instance de client si le token est valide, None sinon.
 
 	"""
+	if session_store.shared:
+		# la session (et sa dernière interaction) sera réenregistrée à la fin de la requête
+		__begin_session(token)
+
 	if token in saved_clients:
 		client_dict = saved_clients[token]
 		if time.time() - client_dict['last_interaction'] < client_timeout_threshold:
-			client_dict['last_interaction'] = time.time()
+			# les interrogations de /events ne prolongent pas la session (voir __poll_events)
+			if not getattr(request_sessions, 'polling', False):
+				client_dict['last_interaction'] = time.time()
 			return 'ok', client_dict['client']
 		else:
-			del saved_clients[token]
-			print(len(saved_clients), 'valid tokens')
+			__drop_session(token, 'expired')
 			return 'expired', None
 	else:
 		return 'notfound', None
 
+# cache des réponses des routes de lecture
+class ResponseCache:
+	"""Cache LRU des réponses des routes de lecture, cloisonné par jeton.
+
+	Les entrées sont indexées par (jeton, route, paramètres) et expirent après le TTL propre à la route.
+	Quand la taille estimée des réponses gardées dépasse max_bytes, les moins récemment utilisées sont évincées.
+
+	Args:
+		max_bytes (int): La taille totale maximale (estimée avec sizeof) des réponses gardées
+	"""
+
+	MISSING = object()
+
+	def __init__(self, max_bytes: int):
+		self.max_bytes = max_bytes
+		self.size = 0
+		self.entries = collections.OrderedDict() # (token, endpoint, params) -> (expires_at, data, size)
+		self.token_keys = {} # token -> set des clés de ce jeton, pour invalider sans parcourir tout le cache
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def make_key(token: str, endpoint: str, params: dict) -> tuple:
+		return (token, endpoint, tuple(sorted(params.items())))
+
+	sizeof_sample = 16 # éléments mesurés par liste pour estimer sa taille : les listes des réponses sont faites d'éléments d'un même schéma
+
+	@classmethod
+	def sizeof(cls, data) -> int:
+		"""Estime la mémoire occupée par une réponse (dictionnaires, listes, chaînes, nombres), en octets.
+		Les clés des dictionnaires, les mêmes chaînes pour tous les éléments d'un schéma, ne sont pas comptées."""
+		size = sys.getsizeof(data)
+		if isinstance(data, dict):
+			for value in data.values():
+				size += cls.sizeof(value)
+		elif isinstance(data, (list, tuple)) and data:
+			sampled = data[::max(1, len(data) // cls.sizeof_sample)]
+			size += sum(cls.sizeof(value) for value in sampled) * len(data) // len(sampled)
+		return size
+
+	def get(self, token: str, endpoint: str, params: dict):
+		"""Retourne la réponse en cache, ou ResponseCache.MISSING si absente ou expirée."""
+		key = self.make_key(token, endpoint, params)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return self.MISSING
+			if entry[0] < time.time():
+				self.__remove(key)
+				self.misses += 1
+				return self.MISSING
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+
+	def set(self, token: str, endpoint: str, params: dict, data, ttl: float):
+		key = self.make_key(token, endpoint, params)
+		size = self.sizeof(data)
+		with self.lock:
+			self.__remove(key)
+			self.entries[key] = (time.time() + ttl, data, size)
+			self.size += size
+			self.token_keys.setdefault(token, set()).add(key)
+			while self.size > self.max_bytes:
+				self.__remove(next(iter(self.entries)))
+
+	def values(self, token: str, endpoint: str) -> list:
+		"""Retourne les réponses en cache, non expirées, d'une route pour un jeton."""
+		now = time.time()
+		with self.lock:
+			return [
+				self.entries[key][1] for key in self.token_keys.get(token, ())
+				if key[1] == endpoint and self.entries[key][0] >= now
+			]
+
+	def invalidate(self, token: str, endpoint: str = None, match=None):
+		"""Supprime les entrées d'un jeton.
+
+		Args:
+			token (str): le jeton dont les entrées sont supprimées
+			endpoint (str, optional): si précisé, seules les entrées de cette route sont supprimées
+			match (callable, optional): si précisé, seules les entrées dont les paramètres (dict) vérifient match(params) sont supprimées
+		"""
+		with self.lock:
+			for key in list(self.token_keys.get(token, ())):
+				if endpoint is not None and key[1] != endpoint:
+					continue
+				if match is not None and not match(dict(key[2])):
+					continue
+				self.__remove(key)
+
+	def __remove(self, key: tuple):
+		entry = self.entries.pop(key, None)
+		if entry is None:
+			return
+		self.size -= entry[2]
+		keys = self.token_keys.get(key[0])
+		if keys is not None:
+			keys.discard(key)
+			if not keys:
+				del self.token_keys[key[0]]
+
+cache_max_bytes = 256 * 1024 * 1024 # taille totale maximale (estimée) des réponses gardées en cache, tous jetons confondus
+cache_ttl = { # durée de vie en sec des réponses en cache, par route
+	'user': 300,
+	'grades': 120,
+	'timetable': 300,
+	'homework': 120,
+	'news': 300,
+	'discussions': 60,
+	'menu': 3600,
+	'recipients': 3600,
+}
+response_cache = ResponseCache(cache_max_bytes)
+
+# regroupement des appels identiques simultanés
+class SingleFlight:
+	"""Regroupe les appels identiques simultanés : un seul est exécuté, les autres attendent et partagent son résultat."""
+
+	class Call:
+		__slots__ = ('done', 'result', 'error')
+
+		def __init__(self):
+			self.done = threading.Event()
+			self.result = None
+			self.error = None
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.calls = {} # clé -> SingleFlight.Call en cours
+		self.executed = 0
+		self.coalesced = 0
+
+	def do(self, key, fn):
+		"""Exécute fn(), ou attend l'appel en cours avec la même clé et retourne son résultat."""
+		with self.lock:
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = self.calls[key] = SingleFlight.Call()
+				self.executed += 1
+			else:
+				self.coalesced += 1
+
+		if not leader:
+			with timed('wait'):
+				call.done.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result
+
+		try:
+			call.result = fn()
+			return call.result
+		except Exception as e:
+			call.error = e
+			raise
+		finally:
+			with self.lock:
+				del self.calls[key]
+			call.done.set()
+
+	def stats(self) -> dict[str, int]:
+		with self.lock:
+			return {
+				'executed': self.executed,
+				'coalesced': self.coalesced,
+				'in_flight': len(self.calls),
+			}
+
+upstream_calls = SingleFlight()
+
+def __fetch(token: str, client: pronotepy.Client, endpoint: str, params: dict, build):
+	"""Retourne la réponse d'une route de lecture, depuis le cache ou en la construisant avec build().
+
+	Les appels identiques simultanés (même jeton, route et paramètres) partagent un seul appel à build(),
+	et les appels à Pronote d'un même client sont exécutés l'un après l'autre.
+
+	Args:
+		token (str): le jeton du client
+		client (pronotepy.Client): le client du jeton
+		endpoint (str): le nom de la route (les routes de cache_ttl sont mises en cache)
+		params (dict): les paramètres de la requête qui déterminent la réponse
+		build (callable): construit la réponse en interrogeant Pronote
+
+	Returns:
+		la réponse de la route
+	"""
+	cached = endpoint in cache_ttl
+	if cached:
+		data = response_cache.get(token, endpoint, params)
+		if data is not ResponseCache.MISSING:
+			cached_bodies.cached = True
+			return data
+
+	def call():
+		lock = __client_lock(client)
+		if not lock.acquire(blocking=False):
+			# attente d'une autre requête du même client
+			with timed('wait'):
+				lock.acquire()
+		try:
+			data = build()
+		finally:
+			lock.release()
+		if cached:
+			response_cache.set(token, endpoint, params, data, cache_ttl[endpoint])
+		return data
+
+	data = upstream_calls.do(ResponseCache.make_key(token, endpoint, params), call)
+	cached_bodies.cached = cached
+	return data
+
+# état propre à chaque client, partagé par les jetons d'un même client
+client_states = weakref.WeakKeyDictionary()
+"""
+client_states ->
+	client (pronotepy.Client) ->
+		lock -> threading.RLock, à acquérir pour toute requête à Pronote avec ce client
+		discussions -> dict[str, pronotepy.Discussion] (id -> discussion, rempli par /discussions)
+		recipients -> tuple[float, dict[str, pronotepy.Recipient]] (expiration, id -> destinataire, voir __get_recipients)
+		homework -> dict[str, pronotepy.Homework] (id -> devoir, rempli par /homework)
+		presence -> dict[str, tuple[float, dict]] (id de période -> expiration, absences/retards/punitions, voir __period_presence)
+		grades -> dict[str, GradesSnapshot] (id de période -> notes de la période, voir __grades_snapshot)
+		periods -> PeriodIndex (index des périodes, voir __period_index)
+		sync -> OrderedDict[str, tuple[tuple, dict]] (curseur -> route et paramètres, empreintes de la réponse, voir __sync)
+		sync_latest -> dict[tuple, tuple[object, str]] (route et paramètres -> dernière réponse et son curseur)
+"""
+client_states_lock = threading.Lock()
+
+def __client_state(client: pronotepy.Client) -> dict:
+	"""Retourne l'état propre à un client (voir client_states)."""
+	with client_states_lock:
+		state = client_states.get(client)
+		if state is None:
+			state = client_states[client] = {'lock': threading.RLock()}
+		return state
+
+def __client_lock(client: pronotepy.Client) -> threading.RLock:
+	"""Retourne le verrou d'un client : Pronote attend les requêtes d'une session dans l'ordre, elles ne doivent pas être concurrentes."""
+	return __client_state(client)['lock']
+
+# synchronisation incrémentale : avec since=<curseur>, /grades, /homework, /news et /discussions ne renvoient que ce qui a changé
+sync_cursors_max = 32 # nombre de curseurs de synchronisation gardés par client
+
+def __sync_snapshot(data, lists: dict) -> dict:
+	"""Retourne l'empreinte de chaque élément des listes d'une réponse : nom de liste -> id -> hash du contenu."""
+	snapshot = {}
+	with timed('sync'):
+		for name, key in lists.items():
+			items = data if name is None else data[name]
+			snapshot[name] = {key(item): hashlib.blake2b(__encode_json(item), digest_size=8).digest() for item in items}
+	return snapshot
+
+def __sync_delta(items: list, key, old: dict, new: dict) -> dict[str, list]:
+	"""Compare une liste à son empreinte précédente."""
+	added = []
+	changed = []
+	for item in items:
+		itemKey = key(item)
+		previous = old.get(itemKey)
+		if previous is None:
+			added.append(item)
+		elif previous != new[itemKey]:
+			changed.append(item)
+	return {
+		"added": added,
+		"changed": changed,
+		"removed": [itemKey for itemKey in old if itemKey not in new],
+	}
+
+def __sync(client: pronotepy.Client, response, scope: tuple, data, since: str|None, lists: dict):
+	"""
+	Associe un curseur de synchronisation à une réponse (en-tête X-Sync-Cursor) et, si since est donné, ne renvoie que les changements depuis ce curseur.
+	Les empreintes sont gardées dans l'état du client ; une réponse servie depuis le cache garde son curseur et n'est pas rehashée.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		response (falcon.Response): La réponse de la requête
+		scope (tuple): La route et ses paramètres : un curseur ne sert que pour les mêmes
+		data (dict|list): La réponse complète
+		since (str|None): Le curseur d'une réponse précédente
+		lists (dict[str|None, Callable]): Les listes de la réponse (None pour la réponse elle-même) -> fonction qui retourne l'id d'un élément
+		
+	Returns:
+		dict|list: La réponse complète si since est absent. Sinon, chaque liste est remplacée par ses changements :
+		
+		{
+			"cursor": str,
+			"reset": bool (le curseur est inconnu ou expiré : tous les éléments sont dans added, les données du client sont à remplacer),
+			"added": list[dict],
+			"changed": list[dict],
+			"removed": list[str] (ids des éléments supprimés),
+		}
+	"""
+	
+	state = __client_state(client)
+	with __client_lock(client):
+		cursors = state.setdefault('sync', collections.OrderedDict())
+		latest = state.setdefault('sync_latest', {})
+		
+		entry = latest.get(scope)
+		if entry is not None and entry[0] is data and entry[1] in cursors:
+			cursor = entry[1]
+		else:
+			try:
+				snapshot = __sync_snapshot(data, lists)
+			except (KeyError, TypeError):
+				# l'id des éléments a été retiré avec fields ou exclude
+				if since is None:
+					return data
+				response.status = falcon.get_http_status(400)
+				return {
+					"status": "error",
+					"error": "since needs the id of each item, it cannot be removed with fields or exclude"
+				}
+			cursor = secrets.token_urlsafe(12)
+			cursors[cursor] = (scope, snapshot)
+			latest[scope] = (data, cursor)
+			while len(cursors) > sync_cursors_max:
+				evicted, (evictedScope, _) = cursors.popitem(last=False)
+				# la dernière réponse d'une portée n'est gardée que tant que son curseur l'est : au plus sync_cursors_max réponses par client
+				if latest.get(evictedScope, (None, None))[1] == evicted:
+					del latest[evictedScope]
+		
+		snapshot = cursors[cursor][1]
+		previous = cursors.get(since) if since is not None else None
+	
+	response.set_header('X-Sync-Cursor', cursor)
+	if since is None:
+		return data
+	# les changements depuis since ne sont pas une réponse du cache
+	cached_bodies.cached = False
+	
+	reset = previous is None or previous[0] != scope
+	deltas = {name: __sync_delta(data if name is None else data[name], key, {} if reset else previous[1][name], snapshot[name]) for name, key in lists.items()}
+	if None in deltas:
+		result = deltas[None]
+	else:
+		result = dict(data)
+		result.update(deltas)
+	return {
+		"cursor": cursor,
+		"reset": reset,
+		**result,
+	}
+
+# nettoyage des sessions
+sessions_max = 5000 # nombre maximal de sessions actives, les plus proches de l'expiration sont évincées au-delà
+reaper_interval = 15 # le temps en sec entre deux passages du nettoyeur de sessions
+sessions_lock = threading.RLock()
+sessions_expiry = []
+"""
+sessions_expiry -> tas (heapq) de (expiration, token)
+	chaque session active y a une entrée, dont l'expiration peut être antérieure à l'expiration réelle si le client a interagi depuis :
+	l'entrée est alors replacée avec la bonne expiration quand elle arrive en tête du tas.
+"""
+sessions_counters = {
+	'created': 0, # sessions créées depuis le démarrage
+	'reused': 0, # sessions créées sur un client déjà connecté avec les mêmes identifiants
+	'expired': 0, # sessions supprimées après client_timeout_threshold sans interaction
+	'evicted': 0, # sessions supprimées pour rester sous sessions_max
+}
+
+def session_counts() -> dict[str, int]:
+	"""Retourne le nombre de sessions actives et les compteurs de sessions créées, expirées et évincées."""
+	with sessions_lock:
+		return {'active': len(saved_clients), **sessions_counters}
+
+def __register_session(token: str, client: pronotepy.Client, login_key: str = None):
+	"""Enregistre une nouvelle session et évince les plus anciennes si sessions_max est dépassé.
+
+	Args:
+		token (str): le jeton de la session
+		client (pronotepy.Client): le client connecté
+		login_key (str, optional): la clé des identifiants du client (voir __login_key), pour le réutiliser lors des prochaines connexions
+	"""
+	now = time.time()
+	with sessions_lock:
+		saved_clients[token] = {
+			'client': client,
+			'last_interaction': now
+		}
+		heapq.heappush(sessions_expiry, (now + client_timeout_threshold, token))
+		sessions_counters['created'] += 1
+
+		if login_key is not None:
+			saved_clients[token]['login_key'] = login_key
+			entry = login_index.get(login_key)
+			if entry is None or entry['client'] is not client:
+				entry = login_index[login_key] = {'client': client, 'tokens': set()}
+			else:
+				sessions_counters['reused'] += 1
+			entry['tokens'].add(token)
+
+		dropped = []
+		while len(saved_clients) > sessions_max:
+			# un tas vide (sessions sans entrée, par exemple réhydratées depuis session_store) ne doit pas bloquer la connexion
+			if not __pop_next_expiring(now, dropped, force=True):
+				break
+	for removed in dropped:
+		__close_session(*removed)
+
+	if session_store.shared:
+		__persist_session(token)
+
+def __drop_session(token: str, reason: str):
+	"""Supprime une session, ses réponses en cache, et ferme les connexions de son client.
+
+	Args:
+		token (str): le jeton de la session
+		reason (str): 'expired' ou 'evicted', le compteur à incrémenter
+	"""
+	removed = __remove_session(token, reason)
+	if removed is not None:
+		__close_session(*removed)
+
+def __remove_session(token: str, reason: str) -> tuple|None:
+	"""Retire une session de saved_clients et de login_index, sans entrée-sortie : peut être appelée avec sessions_lock acquis.
+
+	Returns:
+		tuple|None: les arguments de __close_session, à appeler une fois sessions_lock rendu ; None si la session n'existait plus.
+	"""
+	with sessions_lock:
+		client_dict = saved_clients.pop(token, None)
+		if client_dict is None:
+			return None
+		sessions_counters[reason] += 1
+
+		# le client peut être partagé avec d'autres jetons issus des mêmes identifiants
+		entry = login_index.get(client_dict.get('login_key'))
+		if entry is not None and entry['client'] is client_dict['client']:
+			entry['tokens'].discard(token)
+			shared = bool(entry['tokens'])
+			if not shared:
+				del login_index[client_dict['login_key']]
+		else:
+			shared = False
+	return token, reason, client_dict['client'] if not shared else None
+
+def __close_session(token: str, reason: str, client: pronotepy.Client|None):
+	"""Termine la suppression d'une session retirée par __remove_session : cache, connexions du client, session_store et flux /events.
+
+	Args:
+		token (str): le jeton de la session
+		reason (str): 'expired' ou 'evicted'
+		client (pronotepy.Client|None): le client à fermer, None s'il est encore utilisé par d'autres jetons
+	"""
+	response_cache.invalidate(token)
+	if client is not None:
+		__close_client(client)
+
+	alive = False
+	if session_store.shared:
+		# un autre processus a pu utiliser la session entre-temps, et une session évincée reste dans session_store
+		meta = session_store.get(token)
+		alive = meta is not None and time.time() - meta[1] < client_timeout_threshold
+		if not alive and reason == 'expired':
+			session_store.delete(token)
+
+	# sans cela, un flux /events n'apprendrait la fin de sa session qu'à sa prochaine interrogation, jusqu'à events_max_interval plus tard
+	if not alive:
+		event_scheduler.end(token, 'expired', {'status': 'expired'})
+
+# réutilisation des clients connectés
+login_index = {}
+"""
+login_index ->
+	login_key (HMAC des identifiants, voir __login_key) ->
+		client -> instance de pronotepy.Client
+		tokens -> set des jetons actifs associés à ce client
+"""
+login_index_salt = secrets.token_bytes(32) # propre au processus : les clés ne sont pas réutilisables ailleurs
+
+def __login_key(url: str, username: str, password: str, ent: str|None) -> str|None:
+	"""Retourne la clé de login_index pour ces identifiants.
+
+	Le mot de passe fait partie de la clé : retrouver un client prouve que les identifiants sont les mêmes que lors de sa connexion.
+	Avec un stockage partagé chaque jeton a sa propre copie sérialisée du client, qui ne peut donc pas être partagé : retourne None.
+	"""
+	if session_store.shared:
+		return None
+	return hmac.new(login_index_salt, '\0'.join((url, username, password, ent or '')).encode(), hashlib.sha256).hexdigest()
+
+def __find_logged_in_client(login_key: str|None) -> pronotepy.Client|None:
+	"""Retourne le client encore connecté associé à login_key, s'il existe."""
+	if login_key is None:
+		return None
+	with sessions_lock:
+		entry = login_index.get(login_key)
+		if entry is not None and entry['client'].logged_in:
+			return entry['client']
+	return None
+
+def __client_tokens(token: str) -> list[str]:
+	"""Retourne les jetons qui partagent le client de token (voir login_index), token compris."""
+	with sessions_lock:
+		client_dict = saved_clients.get(token)
+		entry = login_index.get(client_dict.get('login_key')) if client_dict is not None else None
+		if entry is None or entry['client'] is not client_dict['client']:
+			return [token]
+		return list(entry['tokens'] | {token})
+
+def __invalidate_client(token: str, endpoint: str = None, match=None):
+	"""Comme response_cache.invalidate, pour tous les jetons qui partagent le client de token : leurs réponses viennent des mêmes données."""
+	for shared_token in __client_tokens(token):
+		response_cache.invalidate(shared_token, endpoint, match)
+
+def __close_client(client: pronotepy.Client):
+	"""Ferme les connexions HTTP d'un client."""
+	try:
+		client.communication.session.close()
+	except Exception as e:
+		print(f"WARN: Couldn't close session of expired client: {e}")
+
+def __pop_next_expiring(now: float, dropped: list, force: bool = False) -> bool:
+	"""Traite l'entrée en tête de sessions_expiry (sessions_lock doit être acquis).
+
+	Args:
+		now (float): l'heure actuelle (time.time())
+		dropped (list): reçoit la session retirée (voir __remove_session), à fermer avec __close_session une fois sessions_lock rendu
+		force (bool): si True, la session qui expire le plus tôt est évincée même si elle n'a pas expiré
+
+	Returns:
+		bool: False si le tas est vide ou si la prochaine session n'a pas encore expiré, True sinon
+	"""
+	while sessions_expiry:
+		expires_at, token = sessions_expiry[0]
+		client_dict = saved_clients.get(token)
+		if client_dict is None:
+			# session déjà supprimée par get_client
+			heapq.heappop(sessions_expiry)
+			continue
+		actual_expiry = client_dict['last_interaction'] + client_timeout_threshold
+		if actual_expiry > expires_at:
+			# le client a interagi depuis : on replace l'entrée à sa vraie place
+			heapq.heapreplace(sessions_expiry, (actual_expiry, token))
+			continue
+		if expires_at > now and not force:
+			return False
+		heapq.heappop(sessions_expiry)
+		removed = __remove_session(token, 'expired' if expires_at <= now else 'evicted')
+		if removed is not None:
+			dropped.append(removed)
+		return True
+	return False
+
+def __reap_sessions():
+	"""Supprime toutes les sessions expirées."""
+	now = time.time()
+	dropped = []
+	with sessions_lock:
+		while __pop_next_expiring(now, dropped):
+			pass
+	# entrées-sorties (session_store, connexions des clients) hors du verrou : les connexions et get_client ne les attendent pas
+	for removed in dropped:
+		try:
+			__close_session(*removed)
+		except Exception as e:
+			print(f"WARN: Couldn't close session: {e}")
+	session_store.purge(now - client_timeout_threshold)
+
+def __session_reaper():
+	while True:
+		time.sleep(reaper_interval)
+		try:
+			__reap_sessions()
+		except Exception as e:
+			print(f"ERROR: session reaper failed: {e}")
+
+
+# stockage des sessions partagé entre processus
+class SessionStore(abc.ABC):
+	"""Stockage des sessions, partagé entre les processus du serveur.
+
+	saved_clients reste le cache local des clients de chaque processus. Un stockage partagé garde en plus, pour chaque jeton,
+	le client sérialisé, sa version et sa dernière interaction : n'importe quel processus peut alors réhydrater la session
+	sans nouvelle connexion à Pronote. Les clients sont sérialisés avec pickle, le stockage doit donc être de confiance.
+
+	Un client pronotepy ne peut pas être utilisé par deux processus à la fois (chaque requête à Pronote incrémente un compteur
+	propre à la session) : un processus prend donc le verrou du jeton (acquire) avant d'utiliser son client, et le rend (release)
+	après l'avoir réenregistré. Le verrou expire de lui-même si le processus qui le détient s'arrête.
+	"""
+
+	shared = True
+
+	@abc.abstractmethod
+	def get(self, token: str) -> tuple[int, float]|None:
+		"""Retourne le couple (version, last_interaction) du jeton, ou None s'il est inconnu."""
+
+	@abc.abstractmethod
+	def load(self, token: str) -> tuple[int, bytes]|None:
+		"""Retourne le couple (version, client sérialisé) du jeton, ou None s'il est inconnu."""
+
+	@abc.abstractmethod
+	def save(self, token: str, data: bytes, last_interaction: float) -> int:
+		"""Enregistre le client sérialisé du jeton et retourne sa nouvelle version."""
+
+	@abc.abstractmethod
+	def touch(self, token: str, last_interaction: float):
+		"""Met à jour la dernière interaction du jeton, sans changer son client ni sa version."""
+
+	@abc.abstractmethod
+	def delete(self, token: str):
+		"""Supprime la session du jeton."""
+
+	@abc.abstractmethod
+	def acquire(self, token: str, owner: str, ttl: float) -> bool:
+		"""Prend (ou prolonge) le verrou du jeton pour owner pendant ttl secondes. Retourne False s'il est détenu par un autre."""
+
+	@abc.abstractmethod
+	def release(self, token: str, owner: str):
+		"""Rend le verrou du jeton, s'il est toujours détenu par owner."""
+
+	def purge(self, before: float):
+		"""Supprime les sessions dont la dernière interaction est antérieure à before."""
+		pass
+
+class MemorySessionStore(SessionStore):
+	"""Stockage par défaut : les sessions ne vivent que dans saved_clients, propre à chaque processus."""
+
+	shared = False
+
+	def get(self, token):
+		return None
+
+	def load(self, token):
+		return None
+
+	def save(self, token, data, last_interaction):
+		return 0
+
+	def touch(self, token, last_interaction):
+		pass
+
+	def delete(self, token):
+		pass
+
+	def acquire(self, token, owner, ttl):
+		return True
+
+	def release(self, token, owner):
+		pass
+
+class SQLiteSessionStore(SessionStore):
+	"""Stockage dans une base SQLite sur disque, partagée par les processus d'une même machine : sqlite:///chemin/vers/sessions.db"""
+
+	def __init__(self, path: str):
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute(
+			'CREATE TABLE IF NOT EXISTS sessions ('
+			'token TEXT PRIMARY KEY, version INTEGER NOT NULL, last_interaction REAL NOT NULL, client BLOB NOT NULL)'
+		)
+		self.db.execute('CREATE INDEX IF NOT EXISTS sessions_last_interaction ON sessions (last_interaction)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS leases (token TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)')
+
+	def get(self, token):
+		with self.lock:
+			return self.db.execute('SELECT version, last_interaction FROM sessions WHERE token = ?', (token,)).fetchone()
+
+	def load(self, token):
+		with self.lock:
+			return self.db.execute('SELECT version, client FROM sessions WHERE token = ?', (token,)).fetchone()
+
+	def save(self, token, data, last_interaction):
+		with self.lock:
+			self.db.execute(
+				'INSERT INTO sessions (token, version, last_interaction, client) VALUES (?, 1, ?, ?) '
+				'ON CONFLICT (token) DO UPDATE SET version = version + 1, last_interaction = excluded.last_interaction, client = excluded.client',
+				(token, last_interaction, data)
+			)
+			return self.db.execute('SELECT version FROM sessions WHERE token = ?', (token,)).fetchone()[0]
+
+	def touch(self, token, last_interaction):
+		with self.lock:
+			self.db.execute('UPDATE sessions SET last_interaction = MAX(last_interaction, ?) WHERE token = ?', (last_interaction, token))
+
+	def delete(self, token):
+		with self.lock:
+			self.db.execute('DELETE FROM sessions WHERE token = ?', (token,))
+
+	def acquire(self, token, owner, ttl):
+		now = time.time()
+		with self.lock:
+			# BEGIN IMMEDIATE prend le verrou d'écriture de la base : la lecture et la prise du verrou du jeton sont atomiques
+			self.db.execute('BEGIN IMMEDIATE')
+			try:
+				row = self.db.execute('SELECT owner, expires FROM leases WHERE token = ?', (token,)).fetchone()
+				acquired = row is None or row[0] == owner or row[1] < now
+				if acquired:
+					self.db.execute(
+						'INSERT INTO leases (token, owner, expires) VALUES (?, ?, ?) '
+						'ON CONFLICT (token) DO UPDATE SET owner = excluded.owner, expires = excluded.expires',
+						(token, owner, now + ttl)
+					)
+				self.db.execute('COMMIT')
+			except Exception:
+				self.db.execute('ROLLBACK')
+				raise
+			return acquired
+
+	def release(self, token, owner):
+		with self.lock:
+			self.db.execute('DELETE FROM leases WHERE token = ? AND owner = ?', (token, owner))
+
+	def purge(self, before):
+		with self.lock:
+			self.db.execute('DELETE FROM sessions WHERE last_interaction < ?', (before,))
+			self.db.execute('DELETE FROM leases WHERE expires < ?', (time.time(),))
+
+class RedisSessionStore(SessionStore):
+	"""Stockage dans un serveur parlant le protocole Redis (RESP), sans dépendance supplémentaire : redis://[:motdepasse@]hôte:port/base
+
+	Chaque session est un hash (version, last_interaction, client) qui expire de lui-même après client_timeout_threshold.
+	Le verrou d'un jeton est une clé à part, posée avec SET NX PX.
+	"""
+
+	# ne modifient la clé que si elle appartient encore à ce processus (extend, release) ou existe encore (touch)
+	extend_script = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('PEXPIRE', KEYS[1], ARGV[2]) end return 0"
+	release_script = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+	touch_script = (
+		"if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end "
+		"if tonumber(redis.call('HGET', KEYS[1], 'last_interaction')) < tonumber(ARGV[1]) then "
+		"redis.call('HSET', KEYS[1], 'last_interaction', ARGV[1]) end "
+		"return redis.call('EXPIRE', KEYS[1], ARGV[2])"
+	)
+
+	def __init__(self, host: str, port: int, db: int = 0, password: str = None, prefix: str = 'papillon:session:'):
+		self.host = host
+		self.port = port
+		self.db = db
+		self.password = password
+		self.prefix = prefix
+		self.lock = threading.Lock()
+		self.sock = None
+		self.reader = None
+
+	def __connect(self):
+		self.sock = socket.create_connection((self.host, self.port), timeout=5)
+		self.reader = self.sock.makefile('rb')
+		if self.password:
+			self.__send('AUTH', self.password)
+		if self.db:
+			self.__send('SELECT', self.db)
+
+	def __disconnect(self):
+		try:
+			self.sock.close()
+		except Exception:
+			pass
+		self.sock = None
+		self.reader = None
+
+	def __send(self, *args):
+		parts = [b'*%d\r\n' % len(args)]
+		for arg in args:
+			if not isinstance(arg, bytes):
+				arg = str(arg).encode()
+			parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+		self.sock.sendall(b''.join(parts))
+		return self.__read_reply()
+
+	def __read_reply(self):
+		line = self.reader.readline()
+		if not line:
+			raise ConnectionError('connection closed by the session store')
+		kind, value = line[:1], line[1:-2]
+		if kind == b'+':
+			return value
+		elif kind == b'-':
+			raise RuntimeError(f'session store error: {value.decode()}')
+		elif kind == b':':
+			return int(value)
+		elif kind == b'$':
+			if int(value) == -1:
+				return None
+			return self.reader.read(int(value) + 2)[:-2]
+		elif kind == b'*':
+			if int(value) == -1:
+				return None
+			return [self.__read_reply() for _ in range(int(value))]
+		raise RuntimeError(f'unexpected reply from the session store: {line!r}')
+
+	def __command(self, *args):
+		with self.lock:
+			# une seule nouvelle tentative, si la connexion a été coupée depuis la dernière commande
+			for attempt in range(2):
+				try:
+					if self.sock is None:
+						self.__connect()
+					return self.__send(*args)
+				except OSError:
+					self.__disconnect()
+					if attempt:
+						raise
+
+	def get(self, token):
+		version, last_interaction = self.__command('HMGET', self.prefix + token, 'version', 'last_interaction')
+		if version is None:
+			return None
+		return int(version), float(last_interaction)
+
+	def load(self, token):
+		version, data = self.__command('HMGET', self.prefix + token, 'version', 'client')
+		if version is None:
+			return None
+		return int(version), data
+
+	def save(self, token, data, last_interaction):
+		key = self.prefix + token
+		# le client est écrit avant d'incrémenter la version : un processus qui voit la nouvelle version lit forcément le nouveau client
+		self.__command('HSET', key, 'client', data, 'last_interaction', repr(last_interaction))
+		version = self.__command('HINCRBY', key, 'version', 1)
+		self.__command('EXPIRE', key, int(client_timeout_threshold) + 1)
+		return version
+
+	def touch(self, token, last_interaction):
+		self.__command('EVAL', self.touch_script, 1, self.prefix + token, repr(last_interaction), int(client_timeout_threshold) + 1)
+
+	def delete(self, token):
+		self.__command('DEL', self.prefix + token)
+
+	def acquire(self, token, owner, ttl):
+		key = self.prefix + 'lease:' + token
+		if self.__command('SET', key, owner, 'NX', 'PX', int(ttl * 1000)) is not None:
+			return True
+		# déjà détenu par ce processus : le verrou est prolongé
+		return self.__command('EVAL', self.extend_script, 1, key, owner, int(ttl * 1000)) == 1
+
+	def release(self, token, owner):
+		self.__command('EVAL', self.release_script, 1, self.prefix + 'lease:' + token, owner)
+
+def __open_session_store(url: str) -> SessionStore:
+	"""Crée le stockage des sessions décrit par url (memory://, sqlite:///chemin ou redis://hôte:port/base)."""
+	parsed = urllib.parse.urlparse(url)
+	if parsed.scheme == 'memory':
+		return MemorySessionStore()
+	elif parsed.scheme == 'sqlite':
+		return SQLiteSessionStore(parsed.path)
+	elif parsed.scheme == 'redis':
+		return RedisSessionStore(parsed.hostname or 'localhost', parsed.port or 6379, int(parsed.path.lstrip('/') or 0), parsed.password)
+	raise ValueError(f'Unknown session store: {url}')
+
+# memory:// (défaut, un seul processus), sqlite:///chemin/vers/sessions.db ou redis://hôte:port/base pour plusieurs processus
+session_store = __open_session_store(os.environ.get('PAPILLON_SESSION_STORE', 'memory://'))
+session_lease_ttl = 60 # la durée en sec du verrou d'une session, au-delà de laquelle il est libéré si son processus s'est arrêté
+session_lease_wait = 10 # le temps max en sec d'attente d'une session utilisée par un autre processus, avant de répondre 503
+session_lease_secret = secrets.token_hex(8)
+session_leases = {} # jeton -> nombre de requêtes de ce processus qui détiennent son verrou
+session_leases_lock = threading.Lock()
+request_sessions = threading.local() # jetons utilisés par la requête en cours -> état de leur client au début de la requête (voir __client_fingerprint), et polling pendant les interrogations de /events
+
+def __lease_owner() -> str:
+	# le pid est lu à chaque appel : les workers forkés après l'import du module ont chacun le leur
+	return f'{socket.gethostname()}:{os.getpid()}:{session_lease_secret}'
+
+def __acquire_session(token: str) -> bool:
+	"""Prend le verrou partagé du jeton pour ce processus, en attendant au plus session_lease_wait secondes.
+	Les requêtes d'un même processus se partagent le verrou : leurs accès au client passent déjà par son verrou local.
+
+	Returns:
+		bool: False si un autre processus a gardé la session pendant tout ce temps.
+	"""
+	deadline = time.time() + session_lease_wait
+	while True:
+		with session_leases_lock:
+			held = session_leases.get(token, 0)
+			if held or session_store.acquire(token, __lease_owner(), session_lease_ttl):
+				session_leases[token] = held + 1
+				return True
+		if time.time() >= deadline:
+			return False
+		time.sleep(0.05)
+
+def __release_session(token: str):
+	"""Rend le verrou du jeton pris par __acquire_session, une fois que plus aucune requête du processus ne l'utilise."""
+	with session_leases_lock:
+		held = session_leases.pop(token, 0) - 1
+		if held > 0:
+			session_leases[token] = held
+		else:
+			session_store.release(token, __lease_owner())
+
+def __serialize_client(client: pronotepy.Client) -> bytes:
+	return zlib.compress(pickle.dumps(client, pickle.HIGHEST_PROTOCOL), 1)
+
+def __deserialize_client(data: bytes) -> pronotepy.Client:
+	return pickle.loads(zlib.decompress(data))
+
+def __client_fingerprint(client: pronotepy.Client) -> tuple:
+	"""Ce qui change dans un client quand il est utilisé : sa communication avec Pronote (remplacée à chaque reconnexion),
+	le compteur de requêtes de celle-ci, et la période sélectionnée."""
+	communication = client.communication
+	return (communication, getattr(communication, 'request_number', None), getattr(client, 'calculated_period', None))
+
+def __persist_session(token: str):
+	"""Enregistre l'état actuel du client du jeton dans session_store."""
+	client_dict = saved_clients.get(token)
+	if client_dict is None:
+		return
+	try:
+		data = __serialize_client(client_dict['client'])
+	except Exception as e:
+		print(f"WARN: Couldn't serialize client: {e}")
+		return
+	client_dict['version'] = session_store.save(token, data, client_dict['last_interaction'])
+
+def __sync_session(token: str):
+	"""Met à jour la copie locale de la session du jeton depuis session_store, si un autre processus l'a modifiée."""
+	meta = session_store.get(token)
+	client_dict = saved_clients.get(token)
+	if meta is None:
+		if client_dict is not None:
+			__drop_session(token, 'expired')
+		return
+
+	version, last_interaction = meta
+	if client_dict is not None and client_dict.get('version') == version:
+		client_dict['last_interaction'] = max(client_dict['last_interaction'], last_interaction)
+		return
+
+	loaded = session_store.load(token)
+	if loaded is None:
+		return
+	try:
+		client = __deserialize_client(loaded[1])
+	except Exception as e:
+		print(f"WARN: Couldn't deserialize client: {e}")
+		return
+
+	with sessions_lock:
+		previous = saved_clients.get(token)
+		saved_clients[token] = {
+			'client': client,
+			'last_interaction': last_interaction,
+			'version': loaded[0]
+		}
+		if previous is None:
+			heapq.heappush(sessions_expiry, (last_interaction + client_timeout_threshold, token))
+	if previous is not None:
+		__close_client(previous['client'])
+
+def __begin_session(token: str):
+	"""Prend le verrou du jeton pour la requête en cours, puis met à jour sa copie locale depuis session_store.
+	Le verrou est rendu par __end_sessions à la fin de la requête.
+
+	Raises:
+		falcon.HTTPServiceUnavailable: si un autre processus utilise la session depuis plus de session_lease_wait secondes.
+	"""
+	if not __acquire_session(token):
+		raise falcon.HTTPServiceUnavailable(description='This session is in use by another worker, retry later', retry_after=session_lease_wait)
+	sessions = request_sessions.__dict__.setdefault('tokens', {})
+	if token in sessions:
+		__release_session(token)
+		return
+	sessions[token] = None
+	__sync_session(token)
+	client_dict = saved_clients.get(token)
+	if client_dict is not None:
+		sessions[token] = __client_fingerprint(client_dict['client'])
+
+def __end_sessions(persist: bool = True):
+	"""Rend les verrous des jetons utilisés par la requête en cours.
+
+	Args:
+		persist (bool): si True, les clients sont d'abord réenregistrés dans session_store. Un client qui n'a pas servi
+			(réponse en cache, 304...) n'est pas resérialisé : seule sa dernière interaction est enregistrée.
+	"""
+	tokens = request_sessions.__dict__.pop('tokens', None)
+	for token, state in (tokens or {}).items():
+		try:
+			client_dict = saved_clients.get(token)
+			if not persist or state is None or client_dict is None:
+				continue
+			if __client_fingerprint(client_dict['client']) != state:
+				__persist_session(token)
+			else:
+				session_store.touch(token, client_dict['last_interaction'])
+		finally:
+			__release_session(token)
+
+# enregistre les clients utilisés par la requête dans le stockage partagé
+@hug.response_middleware()
+def persist_sessions(request, response, resource):
+	__end_sessions()
+
+threading.Thread(target=__session_reaper, name='session-reaper', daemon=True).start()
+
 @hug.get('/infos')
 def infos():
 	return {
@@ -82,9 +1579,143 @@ def infos():
 		'message': 'server is running',
 		'server': socket.gethostname(),
 		'version': API_VERSION,
+		'sessions': session_counts(),
+		'logins': login_executor.stats(),
+		'upstream_calls': upstream_calls.stats(),
+		'events': event_scheduler.stats(),
 		'ent_list': CAS_LIST
 	}
 
+def __cache_counts() -> dict[tuple, int]:
+	upstream = upstream_calls.stats()
+	return {
+		('responses', 'hit'): response_cache.hits,
+		('responses', 'miss'): response_cache.misses,
+		('upstream_calls', 'executed'): upstream['executed'],
+		('upstream_calls', 'coalesced'): upstream['coalesced'],
+	}
+
+def __cache_hit_ratios() -> dict[tuple, float]:
+	upstream = upstream_calls.stats()
+	lookups = response_cache.hits + response_cache.misses
+	calls = upstream['executed'] + upstream['coalesced']
+	return {
+		('responses',): response_cache.hits / lookups if lookups else 0.0,
+		('upstream_calls',): upstream['coalesced'] / calls if calls else 0.0,
+	}
+
+Metric('papillon_sessions', 'gauge', 'Sessions (jetons) actives', collect=lambda: {(): len(saved_clients)})
+Metric('papillon_sessions_total', 'counter', 'Sessions par événement (created, reused, expired, evicted)', ('event',), collect=lambda: {(event,): count for event, count in sessions_counters.items()})
+Metric('papillon_login_queue', 'gauge', 'Connexions à Pronote en attente (queued) et en cours (running)', ('state',), collect=lambda: {(state,): login_executor.stats()[state] for state in ('queued', 'running')})
+Metric('papillon_cache_requests_total', 'counter', 'Lectures du cache des réponses (hit, miss) et appels à Pronote exécutés ou partagés avec un appel en cours (executed, coalesced)', ('cache', 'result'), collect=__cache_counts)
+Metric('papillon_cache_bytes', 'gauge', 'Taille estimée des réponses gardées dans le cache des réponses', collect=lambda: {(): response_cache.size})
+Metric('papillon_cache_hit_ratio', 'gauge', 'Part des lectures servies par le cache des réponses, et des appels à Pronote partagés avec un appel en cours', ('cache',), collect=__cache_hit_ratios)
+Metric('papillon_event_streams', 'gauge', 'Flux /events ouverts', collect=lambda: {(): event_scheduler.stats()['streams']})
+
+@hug.output_format.content_type('text/plain; version=0.0.4; charset=utf-8')
+def metrics_output(content, request=None, response=None):
+	"""Format texte de Prometheus."""
+	if isinstance(content, str):
+		return content.encode('utf8')
+	return json_output(content, request, response)
+
+@hug.get('/metrics', output=metrics_output)
+def metrics_export():
+	"""
+	Exporte les métriques du serveur au format texte de Prometheus : requêtes et latences par route, latences des appels à Pronote,
+	sessions, connexions par ENT, cache.
+	
+	Returns:
+		str: Les métriques.
+	"""
+	
+	lines = []
+	for metric in metrics:
+		lines.extend(metric.render())
+	return '\n'.join(lines) + '\n'
+
+# connexions à Pronote
+class LoginQueueFull(Exception):
+	"""Levée quand la file d'attente des connexions est pleine."""
+
+class LoginExecutor:
+	"""Pool de taille fixe dédié aux connexions à Pronote (et aux ENT), avec une file d'attente bornée.
+
+	Les connexions sont les appels les plus lents du serveur : les limiter évite qu'un pic de connexions n'occupe
+	tous les threads du serveur au détriment des autres routes.
+	"""
+
+	def __init__(self, workers: int, queue_size: int):
+		self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login')
+		self.slots = threading.BoundedSemaphore(workers + queue_size) # connexions en cours + en attente
+		self.lock = threading.Lock()
+		self.queued = 0
+		self.running = 0
+		self.completed = 0
+		self.rejected = 0
+		self.wait_time_total = 0.0
+		self.wait_time_max = 0.0
+
+	def run(self, fn, *args, **kwargs):
+		"""Exécute fn(*args, **kwargs) dans le pool et attend son résultat.
+
+		Raises:
+			LoginQueueFull: si la file d'attente est pleine
+		"""
+		if not self.slots.acquire(blocking=False):
+			with self.lock:
+				self.rejected += 1
+			raise LoginQueueFull()
+
+		queued_at = time.monotonic()
+		with self.lock:
+			self.queued += 1
+
+		def task():
+			waited = time.monotonic() - queued_at
+			with self.lock:
+				self.queued -= 1
+				self.running += 1
+				self.wait_time_total += waited
+				self.wait_time_max = max(self.wait_time_max, waited)
+			login_wait_duration.observe(value=waited)
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				with self.lock:
+					self.running -= 1
+					self.completed += 1
+				self.slots.release()
+
+		with timed('login'):
+			return self.pool.submit(task).result()
+
+	def stats(self) -> dict:
+		"""Retourne la profondeur de la file d'attente et les temps d'attente (en sec) des connexions."""
+		with self.lock:
+			started = self.completed + self.running
+			return {
+				'queued': self.queued,
+				'running': self.running,
+				'completed': self.completed,
+				'rejected': self.rejected,
+				'wait_time_avg': self.wait_time_total / started if started else 0.0,
+				'wait_time_max': self.wait_time_max,
+			}
+
+login_workers = 8 # nombre de connexions à Pronote menées en parallèle
+login_queue_size = 32 # nombre de connexions en attente au-delà duquel les nouvelles sont refusées
+login_retry_after = 5 # le temps en sec conseillé au client avant de réessayer quand la file est pleine
+login_executor = LoginExecutor(login_workers, login_queue_size)
+
+def __login_queue_full(response):
+	response.status = falcon.get_http_status(503)
+	response.set_header('Retry-After', str(login_retry_after))
+	return {
+		"token": False,
+		"error": "Too many logins in progress, retry later",
+	}
+
 # requête initiale :
 # un client doit faire
 # token = POST /generatetoken body={url, username, password, ent}
@@ -93,6 +1724,18 @@ def infos():
 def generate_token(response, body=None, method: hug.types.one_of(['url', 'qrcode'])='url'):
 	if not body is None:
 		noENT = False
+		login_key = None
+		reused = False
+
+		# vérifié avant la connexion : une erreur ensuite laisserait une session enregistrée
+		try:
+			prefetched = __prefetch_endpoints(body.get('prefetch'))
+		except ValueError as e:
+			response.status = falcon.get_http_status(400)
+			return {
+				"token": False,
+				"error": str(e)
+			}
 
 		if method == "url":
 			for rk in ('url', 'username', 'password', 'ent'):
@@ -105,23 +1748,42 @@ def generate_token(response, body=None, method: hug.types.one_of(['url', 'qrcode
 				elif not rk in body and rk == 'ent':
 					noENT = True 
 
-			try:
-				if noENT:
-					client = pronotepy.Client(body['url'], username=body['username'], password=body['password'])
-				else:
-					client = pronotepy.Client(body['url'], username=body['username'], password=body['password'], ent=getattr(pronotepy.ent, body['ent']))
-			except Exception as e:
-				response.status = falcon.get_http_status(498)
-				print(f"Error while trying to connect to {body['url']}")
-				print(e)
+			# label des métriques : seulement les noms d'ENT connus, pour garder un nombre de séries borné
+			if noENT:
+				ent_label = 'none'
+			elif isinstance(body['ent'], str) and hasattr(pronotepy.ent, body['ent']):
+				ent_label = body['ent']
+			else:
+				ent_label = 'invalid'
 
-				error = {
-					"token": False,
-					"error": str(e),
-				}
-				return error
+			login_key = __login_key(body['url'], body['username'], body['password'], None if noENT else body['ent'])
+			client = __find_logged_in_client(login_key)
+			if client is not None:
+				reused = True
+				login_results.inc(ent_label, 'reused')
+			else:
+				try:
+					if noENT:
+						client = login_executor.run(pronotepy.Client, body['url'], username=body['username'], password=body['password'])
+					else:
+						client = login_executor.run(pronotepy.Client, body['url'], username=body['username'], password=body['password'], ent=getattr(pronotepy.ent, body['ent']))
+				except LoginQueueFull:
+					login_results.inc(ent_label, 'queue_full')
+					return __login_queue_full(response)
+				except Exception as e:
+					login_results.inc(ent_label, 'failure')
+					response.status = falcon.get_http_status(498)
+					print(f"Error while trying to connect to {body['url']}")
+					print(e)
+
+					error = {
+						"token": False,
+						"error": str(e),
+					}
+					return error
 
 		elif method == "qrcode":
+			ent_label = 'qrcode'
 			for rk in ('url', 'qrToken', 'login', 'checkCode'):
 				if not rk in body:
 					response.status = falcon.get_http_status(400)
@@ -138,12 +1800,16 @@ def generate_token(response, body=None, method: hug.types.one_of(['url', 'qrcode
 						}
 
 			try:
-				client = pronotepy.Client.qrcode_login({
+				client = login_executor.run(pronotepy.Client.qrcode_login, {
 					"jeton": body['qrToken'],
 					"login": body['login'],
 					"url": body['url']
 				}, body['checkCode'])
+			except LoginQueueFull:
+				login_results.inc(ent_label, 'queue_full')
+				return __login_queue_full(response)
 			except Exception as e:
+				login_results.inc(ent_label, 'failure')
 				response.status = falcon.get_http_status(498)
 				print(e)
 
@@ -155,19 +1821,18 @@ def generate_token(response, body=None, method: hug.types.one_of(['url', 'qrcode
 		
 		token = secrets.token_urlsafe(16)
 
-		# Set current period
-		client.calculated_period = __get_current_period(client)
-		client.activated_period = __get_current_period(client, False, None, True)
-
-		saved_clients[token] = {
-			'client': client,
-			'last_interaction': time.time()
-		}
+		# Set current period (un client réutilisé garde la période choisie par ses autres jetons)
+		if not reused:
+			client.calculated_period = __get_current_period(client)
+			client.activated_period = __get_current_period(client, False, None, True)
 
-		print(len(saved_clients), 'valid tokens')
+		__register_session(token, client, login_key if client.logged_in else None)
+		if not reused:
+			login_results.inc(ent_label, 'success' if client.logged_in else 'failure')
 
 		# if error return error
 		if client.logged_in:
+			__prefetch(token, prefetched)
 			tokenArray = {
 				"token": token,
 				"error": False
@@ -189,6 +1854,80 @@ def generate_token(response, body=None, method: hug.types.one_of(['url', 'qrcode
 		return error
 
 
+class PeriodIndex:
+	"""
+	Les périodes d'un client, résolues une fois par session au lieu de parcourir client.periods à chaque fois.
+	
+	Attributes:
+		by_name (dict[str, pronotepy.Period]): Nom -> période
+		by_type (dict[str, list[pronotepy.Period]]): Type de période ("Trimestre", "Semestre", "Année"...) -> périodes de ce type, triées par date de début
+		default (pronotepy.Period): La période par défaut donnée par Pronote
+		current_type (str|None): Le type de la période par défaut, None s'il n'est pas reconnu
+		current (pronotepy.Period): La période en cours, à la date du dernier calcul
+		boundary (datetime.datetime|None): Le jour à partir duquel la période en cours doit être recalculée, None si elle ne change plus
+	"""
+
+	period_types = ('Trimestre', 'Semestre', 'Année') # les types de périodes reconnus
+
+	def __init__(self, client: pronotepy.Client):
+		self.by_name = {}
+		self.by_type = {}
+		for period in client.periods:
+			self.by_name[period.name] = period
+			self.by_type.setdefault(period.name.split(' ')[0], []).append(period)
+		for periods in self.by_type.values():
+			periods.sort(key=lambda period: period.start)
+		self.starts = {periodType: [period.start for period in periods] for periodType, periods in self.by_type.items()}
+
+		self.default = client.current_period
+		self.current_type = self.default.name.split(' ')[0]
+		if self.current_type not in self.period_types:
+			print("WARN: Couldn't find current period name")
+			self.current_type = None
+		self.__resolve(self.__today())
+
+	@staticmethod
+	def __today() -> datetime.datetime:
+		raw = datetime.datetime.now().date()
+		return datetime.datetime(raw.year, raw.month, raw.day)
+
+	def __resolve(self, now: datetime.datetime):
+		"""Calcule la période en cours par dichotomie sur les dates de début, et le jour où elle changera."""
+		self.current = self.default
+		self.boundary = None
+		if self.current_type is None:
+			return
+
+		periods = self.by_type[self.current_type]
+		starts = self.starts[self.current_type]
+		i = bisect.bisect_right(starts, now) - 1
+		if i >= 0 and now <= periods[i].end:
+			self.current = periods[i]
+			self.boundary = datetime.datetime.combine(periods[i].end.date(), datetime.time()) + datetime.timedelta(days=1)
+		elif i + 1 < len(periods):
+			# entre deux périodes : la période par défaut, jusqu'au début de la suivante
+			self.boundary = datetime.datetime.combine(starts[i + 1].date(), datetime.time())
+
+	def current_period(self) -> pronotepy.Period:
+		"""Retourne la période en cours, recalculée si la date a franchi une limite de période."""
+		if self.boundary is not None and datetime.datetime.now() >= self.boundary:
+			self.__resolve(self.__today())
+		return self.current
+
+	def current_periods(self) -> list[pronotepy.Period]:
+		"""Retourne toutes les périodes du même type que la période en cours."""
+		if self.current_type is None:
+			return [self.default]
+		return list(self.by_type[self.current_type])
+
+def __period_index(client: pronotepy.Client) -> PeriodIndex:
+	"""Retourne l'index des périodes d'un client, construit à la première utilisation."""
+	state = __client_state(client)
+	index = state.get('periods')
+	if index is None:
+		index = state['periods'] = PeriodIndex(client)
+	return index
+
 # TODO: METTRE A JOUR CETTE PARTIE SI DES PROBLEMES APPARAISSENT
 # Peut poser problème avec certains établissements
 def __get_current_period(client: pronotepy.Client, wantSpecificPeriod: bool = False, specificPeriod: str = None, wantAllPeriods: bool = False) -> pronotepy.Period:
@@ -206,38 +1945,74 @@ def __get_current_period(client: pronotepy.Client, wantSpecificPeriod: bool = Fa
 	"""
 	
 	if client.logged_in:
-		if not wantSpecificPeriod:
-			CURRENT_PERIOD_NAME = client.current_period.name.split(' ')[0]
-			if CURRENT_PERIOD_NAME == 'Trimestre':
-				CURRENT_PERIOD_NAME = 'Trimestre'
-			elif CURRENT_PERIOD_NAME == 'Semestre':
-				CURRENT_PERIOD_NAME = 'Semestre'
-			elif CURRENT_PERIOD_NAME == 'Année':
-				CURRENT_PERIOD_NAME = 'Année'
-			else:
-				print("WARN: Couldn't find current period name")
-				return client.current_period
-			
-			if wantAllPeriods: allPeriods = []
-
-			for period in client.periods:
-				if period.name.split(' ')[0] == CURRENT_PERIOD_NAME:
-					
-					if not wantAllPeriods:   
-						raw = datetime.datetime.now().date()
-						now = datetime.datetime(raw.year, raw.month, raw.day)
-						if period.start <= now <= period.end:
-							return period
-					else:
-						allPeriods.append(period)
-			
-			return allPeriods
-		else:
-			for period in client.periods:
-				if period.name == specificPeriod:
-					return period
+		index = __period_index(client)
+		if wantSpecificPeriod:
+			period = index.by_name.get(specificPeriod)
+			if period is not None:
+				return period
 			print("WARN: Couldn't find specific period name")
-			return __get_current_period(client, False, None)
+		
+		if wantAllPeriods:
+			return index.current_periods()
+		return index.current_period()
+
+def __selected_period(client: pronotepy.Client) -> pronotepy.Period:
+	"""
+	Retourne la période sélectionnée du client.
+	Si elle n'a pas été choisie avec /changePeriod, elle suit la période en cours quand la date franchit une limite de période.
+	"""
+	
+	index = __period_index(client)
+	previous = index.current
+	current = index.current_period()
+	if current is not previous and client.calculated_period.id == previous.id:
+		client.calculated_period = current
+	return client.calculated_period
+
+def __find_period(client: pronotepy.Client, periodName: str) -> pronotepy.Period|None:
+	"""
+	Retrouve une période par son nom, avec l'index des périodes du client.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		periodName (str): Le nom de la période
+		
+	Returns:
+		pronotepy.Period|None: La période, None si aucune période ne porte ce nom.
+	"""
+	
+	return __period_index(client).by_name.get(periodName)
+
+def __requested_periods(client: pronotepy.Client, period: str|None, periods: str|None) -> list[pronotepy.Period]|None:
+	"""
+	Retrouve les périodes demandées par les paramètres period et periods d'une requête, sans toucher à la période sélectionnée du client.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		period (str|None): Le nom d'une période, la période sélectionnée (voir /changePeriod) si absent
+		periods (str|None): "all" pour toutes les périodes de l'année, ou des noms de périodes séparés par des virgules. Prioritaire sur period.
+		
+	Returns:
+		list[pronotepy.Period]|None: Les périodes demandées, None si l'une d'elles n'existe pas.
+	"""
+	
+	if periods is not None:
+		if periods == 'all':
+			return list(client.activated_period)
+		selected = [__find_period(client, name.strip()) for name in periods.split(',')]
+	elif period is not None:
+		selected = [__find_period(client, period)]
+	else:
+		selected = [__selected_period(client)]
+	return None if None in selected else selected
+
+def __unknown_period(response) -> dict[str, str]:
+	"""Réponse d'une requête demandant une période qui n'existe pas."""
+	response.status = falcon.get_http_status(404)
+	return {
+		"status": "not found",
+		"error": "La période n'a pas été trouvée."
+	}
 
 
 @hug.post('/changePeriod')
@@ -258,11 +2033,14 @@ def change_period(token: str, response, periodName: str):
 	if success == 'ok':
 		if client.logged_in:
 			try:
-				client.calculated_period = __get_current_period(client, True, periodName)
-				return {
-					'status': 'ok',
-					'period': client.calculated_period.name
-				}
+				with __client_lock(client):
+					client.calculated_period = __get_current_period(client, True, periodName)
+					# /user indique la période sélectionnée
+					__invalidate_client(token, 'user')
+					return {
+						'status': 'ok',
+						'period': client.calculated_period.name
+					}
 			except Exception as e:
 				response.status = falcon.get_http_status(500)
 				return {
@@ -303,47 +2081,79 @@ def user(token: str, response):
 	success, client = get_client(token)
 	if success == 'ok':
 		if client.logged_in:
-			periods = []
-			for period in client.periods:
-				periods.append({
-					'start': period.start.strftime('%Y-%m-%d'),
-					'end': period.end.strftime('%Y-%m-%d'),
-					'name': period.name,
-					'id': period.id,
-					'actual': client.calculated_period.id == period.id
-				})
-
-			userData = {
-				"name": client.info.name,
-				"class": client.info.class_name,
-				"establishment": client.info.establishment,
-				"phone": client.info.phone,
-				"email": client.info.email,
-				"address": client.info.address,
-				"ine": client.info.ine_number,
-				"profile_picture": client.info.profile_picture.url if client.info.profile_picture else None,
-				"delegue": client.info.delegue,
-				"periods": periods
-			}
+			def fetch_user():
+				selected = __selected_period(client)
+				periods = []
+				for period in client.periods:
+					periods.append({
+						'start': period.start.strftime(day_format),
+						'end': period.end.strftime(day_format),
+						'name': period.name,
+						'id': period.id,
+						'actual': selected.id == period.id
+					})
+
+				userData = {
+					"name": client.info.name,
+					"class": client.info.class_name,
+					"establishment": client.info.establishment,
+					"phone": client.info.phone,
+					"email": client.info.email,
+					"address": client.info.address,
+					"ine": client.info.ine_number,
+					"profile_picture": client.info.profile_picture.url if client.info.profile_picture else None,
+					"delegue": client.info.delegue,
+					"periods": periods
+				}
+
+				return userData
 
-			return userData
+			return __fetch(token, client, 'user', {}, fetch_user)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
 
+# voir /timetable
+lesson_schema = Schema({
+	"id": "id",
+	"num": "num",
+	"subject": __subject_field(),
+	"teachers": "teacher_names",
+	"rooms": "classrooms",
+	"group_names": "group_names",
+	"memo": "memo",
+	"virtual": "virtual_classrooms",
+	"start": __date_field("start"),
+	"end": __date_field("end"),
+	"background_color": "background_color",
+	"status": "status",
+	"is_cancelled": "canceled",
+	"is_outing": "outing",
+	"is_detention": "detention",
+	"is_exempted": "exempted",
+	"is_test": "test",
+})
+
+timetable_max_days = 31 # nombre maximal de jours demandés en une fois à /timetable
+
 @hug.get('/timetable')
-def timetable(token: str, dateString: str, response):
+def timetable(token: str, response, dateString: str = None, dateFrom: str = None, dateTo: str = None, fields: str = None, exclude: str = None):
 	"""
-	Récupère l'emploi du temps de l'utilisateur.
+	Récupère l'emploi du temps de l'utilisateur, sur une date ou entre deux dates.
 	
 	Args:
 		token (str): Le token du client Pronote
-		dateString (str): La date à récupérer sous la forme YYYY-MM-DD
 		response (falcon.Response): La réponse de la requête
+		dateString (str, optional): La date à récupérer sous la forme YYYY-MM-DD
+		dateFrom (str, optional): La date de début à récupérer sous la forme YYYY-MM-DD (à la place de dateString)
+		dateTo (str, optional): La date de fin à récupérer sous la forme YYYY-MM-DD (à la place de dateString)
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
-		list[dict]: Les informations de l'emploi du temps :
+		list[dict]|dict[str, list[dict]]: Avec dateString, les informations de l'emploi du temps. Avec dateFrom et dateTo, 
+		un dictionnaire { "YYYY-MM-DD": list[dict] } avec les cours de chaque jour de la période.
 		
 		[{
 			"id": str,
@@ -367,47 +2177,79 @@ def timetable(token: str, dateString: str, response):
 		}]
 	"""
 	
-	dateToGet = datetime.datetime.strptime(dateString, "%Y-%m-%d").date()
+	if dateFrom is not None and dateTo is not None:
+		dateFrom = datetime.datetime.strptime(dateFrom, "%Y-%m-%d").date()
+		dateTo = datetime.datetime.strptime(dateTo, "%Y-%m-%d").date()
+		days = [dateFrom + datetime.timedelta(days=n) for n in range((dateTo - dateFrom).days + 1)]
+		if not 0 < len(days) <= timetable_max_days:
+			response.status = falcon.get_http_status(400)
+			return {
+				"status": "error",
+				"error": f"dateTo must be between dateFrom and {timetable_max_days} days later"
+			}
+	elif dateString is not None:
+		dateToGet = datetime.datetime.strptime(dateString, "%Y-%m-%d").date()
+	else:
+		response.status = falcon.get_http_status(400)
+		return {
+			"status": "error",
+			"error": "Missing dateString, or dateFrom and dateTo"
+		}
 	success, client = get_client(token)
 
 	if success == 'ok':
 		if client.logged_in:
-			lessons = client.lessons(dateToGet)
-
-			lessonsData = []
-			for lesson in lessons:
-				lessonData = {
-					"id": lesson.id,
-					"num": lesson.num,
-					"subject": {
-						"id": lesson.subject.id if lesson.subject is not None else "0",
-						"name": lesson.subject.name if lesson.subject is not None else "",
-						"groups": lesson.subject.groups if lesson.subject is not None else False
-					},
-					"teachers": lesson.teacher_names,
-					"rooms": lesson.classrooms,
-					"group_names": lesson.group_names,
-					"memo": lesson.memo,
-					"virtual": lesson.virtual_classrooms,
-					"start": lesson.start.strftime("%Y-%m-%d %H:%M"),
-					"end": lesson.end.strftime("%Y-%m-%d %H:%M"),
-					"background_color": lesson.background_color,
-					"status": lesson.status,
-					"is_cancelled": lesson.canceled,
-					"is_outing": lesson.outing,
-					"is_detention": lesson.detention,
-					"is_exempted": lesson.exempted,
-					"is_test": lesson.test,
-				}
-				lessonsData.append(lessonData)
+			schema, projection = __projection(lesson_schema, fields, exclude)
+			if dateFrom is None or dateTo is None:
+				def fetch_timetable():
+					lessons = client.lessons(dateToGet)
+					return schema.dump_many(lessons)
+
+				return __fetch(token, client, 'timetable', {'dateString': dateToGet.isoformat(), **projection}, fetch_timetable)
+
+			def fetch_timetable_range():
+				# la période peut déjà être couverte par des requêtes précédentes, jour par jour
+				timetableData = {}
+				for day in days:
+					lessonsData = response_cache.get(token, 'timetable', {'dateString': day.isoformat(), **projection})
+					if lessonsData is ResponseCache.MISSING:
+						break
+					timetableData[day.isoformat()] = lessonsData
+				else:
+					return timetableData
+
+				timetableData = {day.isoformat(): [] for day in days}
+				for lesson in client.lessons(dateFrom, dateTo):
+					timetableData.setdefault(lesson.start.strftime(day_format), []).append(schema.dump(lesson))
+
+				# chaque jour est mis en cache pour servir les requêtes d'une seule date
+				for day, lessonsData in timetableData.items():
+					response_cache.set(token, 'timetable', {'dateString': day, **projection}, lessonsData, cache_ttl['timetable'])
+				return timetableData
 
-			return lessonsData
+			return __fetch(token, client, 'timetable', {'dateFrom': dateFrom.isoformat(), 'dateTo': dateTo.isoformat(), **projection}, fetch_timetable_range)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
+# fichiers joints (devoirs, actualités, punitions)
+attachment_schema = Schema({
+	"id": "id",
+	"name": "name",
+	"url": "url",
+	"type": "type",
+})
+
+# voir /content
+content_schema = Schema({
+	"title": "title",
+	"description": "description",
+	"category": "category",
+	"files": __list_field("files", attachment_schema),
+})
+
 @hug.get('/content')
-def content(token: str, dateString: str, response):
+def content(token: str, dateString: str, response, fields: str = None, exclude: str = None):
 	"""
 	Récupère le contenu des cours.
 	
@@ -415,9 +2257,23 @@ def content(token: str, dateString: str, response):
 		token (str): Le token du client Pronote
 		dateString (str): La date à récupérer sous la forme YYYY-MM-DD
 		response (falcon.Response): La réponse de la requête
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
-		list[dict]: Les contenus du cours 
+		list[dict]: Les contenus des cours du jour, sous la forme :
+		
+		{
+			"title": str,
+			"description": str,
+			"category": str,
+			"files": list[dict {
+				"id": str,
+				"name": str,
+				"url": str,
+				"type": int
+			}]
+		}
 	"""
 	
 	dateToGet = datetime.datetime.strptime(dateString, "%Y-%m-%d").date()
@@ -425,37 +2281,33 @@ def content(token: str, dateString: str, response):
 
 	if success == 'ok':
 		if client.logged_in:
-			content = client.lessons(dateToGet, dateToGet)
-
-			contentData = []
-			for lesson in content:
-				if lesson.content != None:
-					for contentElement in lesson.content:
-						files = []
-						for file in contentElement.files:
-							files.append({
-								"id": file.id,
-								"name": file.name,
-								"url": file.url,
-								"type": file.type
-							})
-						
-						contentList = {
-							"title": contentElement.title,
-							"description": contentElement.description,
-							"category": contentElement.category,
-							"files": files
-						}
+			schema, projection = __projection(content_schema, fields, exclude)
+			def fetch_content():
+				contents = []
+				for lesson in client.lessons(dateToGet, dateToGet):
+					if lesson.content != None:
+						contents.extend(lesson.content)
 
-				contentData.append(contentList)
+				return schema.dump_many(contents)
 
-			return contentData
+			return __fetch(token, client, 'content', {'dateString': dateString, **projection}, fetch_content)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
+# voir /homework
+homework_schema = Schema({
+	"id": "id",
+	"subject": __subject_field(),
+	"description": "description",
+	"background_color": "background_color",
+	"done": "done",
+	"date": __date_field("date"),
+	"files": __list_field("files", attachment_schema),
+})
+
 @hug.get('/homework')
-def homework(token: str, dateFrom: str, dateTo: str, response):
+def homework(token: str, dateFrom: str, dateTo: str, response, fields: str = None, exclude: str = None, since: str = None):
 	"""
 	Récupère les devoirs de l'utilisateur.
 	
@@ -464,6 +2316,9 @@ def homework(token: str, dateFrom: str, dateTo: str, response):
 		dateFrom (str): La date de début à récupérer sous la forme YYYY-MM-DD
 		dateTo (str): La date de fin à récupérer sous la forme YYYY-MM-DD
 		response (falcon.Response): La réponse de la requête
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
+		since (str, optional): Le curseur (en-tête X-Sync-Cursor) d'une réponse précédente, pour ne recevoir que les changements depuis (voir __sync)
 		
 	Returns:
 		list[dict]: Les informations des devoirs :
@@ -493,35 +2348,15 @@ def homework(token: str, dateFrom: str, dateTo: str, response):
 
 	if success == 'ok':
 		if client.logged_in:
-			homeworks = client.homework(date_from=dateFrom, date_to=dateTo)
-
-			homeworksData = []
-			for homework in homeworks:
-				files = []
-				for file in homework.files:
-					files.append({
-						"id": file.id,
-						"name": file.name,
-						"url": file.url,
-						"type": file.type
-					})
+			schema, projection = __projection(homework_schema, fields, exclude)
+			def fetch_homework():
+				homeworks = client.homework(date_from=dateFrom, date_to=dateTo)
+				__client_state(client).setdefault('homework', {}).update((homework.id, homework) for homework in homeworks)
 
-				homeworkData = {
-					"id": homework.id,
-					"subject": {
-						"id": homework.subject.id,
-						"name": homework.subject.name,
-						"groups": homework.subject.groups,
-					},
-					"description": homework.description,
-					"background_color": homework.background_color,
-					"done": homework.done,
-					"date": homework.date.strftime("%Y-%m-%d %H:%M"),
-					"files": files
-				}
-				homeworksData.append(homeworkData)
+				return schema.dump_many(homeworks)
 
-			return homeworksData
+			homeworkData = __fetch(token, client, 'homework', {'dateFrom': dateFrom, 'dateTo': dateTo, **projection}, fetch_homework)
+			return __sync(client, response, ('homework', dateFrom, dateTo, tuple(projection.items())), homeworkData, since, {None: operator.itemgetter('id')})
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
@@ -593,17 +2428,117 @@ def __transform_to_number(value:str)->float|int:
 		return float(value.replace(",", "."))
 
 
+class GradesSnapshot:
+	"""
+	Notes, moyennes et moyennes générales d'une période, obtenues en un seul appel à Pronote.
+	pronotepy.Period.grades, averages, overall_average et class_overall_average demandent chacun la même page à Pronote.
+	
+	Attributes:
+		period (pronotepy.Period): La période
+		fetched_at (float): Le moment de l'appel à Pronote (time.time())
+		grades (list[pronotepy.Grade]): Les notes
+		averages (list[pronotepy.Average]): Les moyennes par matière
+		overall_average (str): La moyenne générale, calculée si Pronote ne la donne pas
+		class_overall_average (str|None): La moyenne générale de la classe
+	"""
+
+	def __init__(self, client: pronotepy.Client, period: pronotepy.Period):
+		# même requête que pronotepy.Period.grades
+		json_data = {"Periode": {"N": period.id, "L": period.name}}
+		data = client.post("DernieresNotes", 198, json_data)["dataSec"]["data"]
+
+		self.period = period
+		self.fetched_at = time.time()
+		self.grades = [pronotepy.Grade(grade) for grade in data["listeDevoirs"]["V"]]
+		services = data["listeServices"]["V"]
+		self.averages = [pronotepy.Average(service) for service in services]
+
+		if data.get("moyGenerale"):
+			self.overall_average = data["moyGenerale"]["V"]
+		else:
+			# même calcul que pronotepy.Period.overall_average quand Pronote ne donne pas la moyenne générale
+			total = 0
+			count = 0
+			for service in services:
+				try:
+					value = float(service["moyEleve"]["V"].replace(",", "."))
+				except (KeyError, ValueError):
+					continue
+				if value:
+					total += value
+					count += 1
+			self.overall_average = str(round(total / count, 2) if count else -1)
+
+		self.class_overall_average = data["moyGeneraleClasse"]["V"] if data.get("moyGeneraleClasse") else None
+
+def __grades_snapshot(client: pronotepy.Client, period: pronotepy.Period) -> GradesSnapshot:
+	"""
+	Récupère les notes d'une période, gardées cache_ttl['grades'] secondes dans l'état du client. Le verrou du client doit être acquis.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		period (pronotepy.Period): La période
+		
+	Returns:
+		GradesSnapshot: Les notes de la période.
+	"""
+	
+	snapshots = __client_state(client).setdefault('grades', {})
+	snapshot = snapshots.get(period.id)
+	if snapshot is None or snapshot.fetched_at + cache_ttl['grades'] < time.time():
+		snapshot = snapshots[period.id] = GradesSnapshot(client, period)
+	return snapshot
+
+
+# voir /grades
+grade_schema = Schema({
+	"id": "id",
+	"subject": __subject_field(),
+	"date": __date_field("date"),
+	"description": "comment",
+	"is_bonus": "is_bonus",
+	"is_optional": "is_optionnal",
+	"is_out_of_20": "is_out_of_20",
+	"grade": __object_field(Schema({
+		"value": lambda grade: __transform_to_number(__get_grade_state(grade.grade)),
+		"out_of": lambda grade: __transform_to_number(grade.out_of),
+		"coefficient": lambda grade: __transform_to_number(grade.coefficient),
+		"average": lambda grade: __transform_to_number(__get_grade_state(grade.average)),
+		"max": lambda grade: __transform_to_number(__get_grade_state(grade.max)),
+		"min": lambda grade: __transform_to_number(__get_grade_state(grade.min)),
+		"significant": lambda grade: __get_grade_state(grade.grade, True),
+	})),
+})
+
+average_schema = Schema({
+	"subject": __subject_field(),
+	"average": lambda average: __transform_to_number(__get_grade_state(average.student)),
+	"class_average": lambda average: __transform_to_number(__get_grade_state(average.class_average)),
+	"max": lambda average: __transform_to_number(__get_grade_state(average.max)),
+	"min": lambda average: __transform_to_number(__get_grade_state(average.min)),
+	"out_of": lambda average: __transform_to_number(__get_grade_state(average.out_of)),
+	"significant": lambda average: __get_grade_state(average.student, True),
+	"color": lambda average: average.background_color if average.background_color != None else "#08BE88",
+})
+
 @hug.get('/grades')
-def grades(token: str, response):
+def grades(token: str, response, period: str = None, periods: str = None, fields: str = None, exclude: str = None, averageFields: str = None, averageExclude: str = None, since: str = None):
 	"""
 	Récupère les notes de l'utilisateur.
 	
 	Args:
 		token (str): Le token du client Pronote
+		period (str, optional): Le nom de la période, la période sélectionnée si absent
+		periods (str, optional): "all" ou des noms de périodes séparés par des virgules, pour obtenir plusieurs périodes à la fois
 		response (falcon.Response): La réponse de la requête
+		fields (str, optional): Les champs à renvoyer pour chaque note, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque note, séparés par des virgules
+		averageFields (str, optional): Comme fields, pour chaque moyenne
+		averageExclude (str, optional): Comme exclude, pour chaque moyenne
+		since (str, optional): Le curseur (en-tête X-Sync-Cursor) d'une réponse précédente, pour ne recevoir que les changements depuis (voir __sync)
 		
 	Returns:
-		dict: Les informations des notes :
+		dict: Les informations des notes (avec periods, un dict nom de période -> informations des notes) :
 		
 		{
 			grades : [{
@@ -648,70 +2583,112 @@ def grades(token: str, response):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		allGrades = client.calculated_period.grades
-		gradesData = []
-		for grade in allGrades:
-			gradeData = {
-				"id": grade.id,
-				"subject": {
-					"id": grade.subject.id,
-					"name": grade.subject.name,
-					"groups": grade.subject.groups,
-				},
-				"date": grade.date.strftime("%Y-%m-%d %H:%M"),
-				"description": grade.comment,
-				"is_bonus": grade.is_bonus,
-				"is_optional": grade.is_optionnal,
-				"is_out_of_20": grade.is_out_of_20,
-				"grade": {
-					"value": __transform_to_number(__get_grade_state(grade.grade)),
-					"out_of": __transform_to_number(grade.out_of),
-					"coefficient": __transform_to_number(grade.coefficient),
-					"average": __transform_to_number(__get_grade_state(grade.average)),
-					"max": __transform_to_number(__get_grade_state(grade.max)),
-					"min": __transform_to_number(__get_grade_state(grade.min)),
-					"significant": __get_grade_state(grade.grade, True),
-				}
+		gradeSchema, projection = __projection(grade_schema, fields, exclude)
+		averageSchema, averageProjection = __projection(average_schema, averageFields, averageExclude)
+		projection.update(('average_' + key, value) for key, value in averageProjection.items())
+		def fetch_grades(period):
+			snapshot = __grades_snapshot(client, period)
+			gradeReturn = {
+				"grades": gradeSchema.dump_many(snapshot.grades),
+				"averages": averageSchema.dump_many(snapshot.averages),
+				"overall_average": __transform_to_number(__get_grade_state(snapshot.overall_average)),
+				"class_overall_average": __transform_to_number(__get_grade_state(snapshot.class_overall_average)),
 			}
 
-			gradesData.append(gradeData)
+			return gradeReturn
 
-		averagesData = []
+		selected = __requested_periods(client, period, periods)
+		if selected is None:
+			return __unknown_period(response)
 
-		allAverages = client.calculated_period.averages
-		for average in allAverages:
-			averageData = {
-				"subject": {
-					"id": average.subject.id,
-					"name": average.subject.name,
-					"groups": average.subject.groups,
-				},
-				"average": __transform_to_number(__get_grade_state(average.student)),
-				"class_average": __transform_to_number(__get_grade_state(average.class_average)),
-				"max": __transform_to_number(__get_grade_state(average.max)),
-				"min": __transform_to_number(__get_grade_state(average.min)),
-				"out_of": __transform_to_number(__get_grade_state(average.out_of)),
-				"significant": __get_grade_state(average.student, True),
-				"color": average.background_color if average.background_color != None else "#08BE88"
+		if periods is not None and since is not None:
+			response.status = falcon.get_http_status(400)
+			return {
+				"status": "error",
+				"error": "since cannot be used with periods"
 			}
 
-			averagesData.append(averageData)
+		# chaque période a sa propre entrée dans le cache, partagée avec les requêtes d'une seule période
+		gradesByPeriod = {period.name: __fetch(token, client, 'grades', {'period': period.id, **projection}, lambda period=period: fetch_grades(period)) for period in selected}
+		if periods is not None:
+			return gradesByPeriod
+		
+		# les moyennes, peu nombreuses et sans id, sont toujours renvoyées en entier
+		return __sync(client, response, ('grades', selected[0].id, tuple(projection.items())), gradesByPeriod[selected[0].name], since, {"grades": operator.itemgetter('id')})
+	else:
+		response.status = falcon.get_http_status(498)
+		return success
+
+
+presence_current_ttl = 120 # le temps en sec pendant lequel les absences, retards et punitions d'une période en cours sont gardés
+presence_closed_ttl = 6 * 3600 # le temps en sec pendant lequel ceux d'une période terminée, qui ne changent presque plus, sont gardés
+
+def __period_presence(client: pronotepy.Client, period: pronotepy.Period) -> dict[str, list]:
+	"""
+	Récupère les absences, retards et punitions d'une période.
+	Pronote les envoie dans la même page : un seul appel sert les trois, au lieu d'un par propriété de pronotepy.Period.
+	Le résultat est gardé dans l'état du client, plus longtemps si la période est terminée. Le verrou du client doit être acquis.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		period (pronotepy.Period): La période
+		
+	Returns:
+		dict[str, list]: { "absences": list[pronotepy.Absence], "delays": list[pronotepy.Delay], "punishments": list[pronotepy.Punishment] }
+	"""
+	
+	periodsPresence = __client_state(client).setdefault('presence', {})
+	cached = periodsPresence.get(period.id)
+	if cached is not None and cached[0] >= time.time():
+		return cached[1]
+
+	# même requête que pronotepy.Period.absences, delays et punishments
+	json_data = {
+		"periode": {"N": period.id, "L": period.name, "G": 2},
+		"DateDebut": {"_T": 7, "V": period.start.strftime("%d/%m/%Y %H:%M:%S")},
+		"DateFin": {"_T": 7, "V": period.end.strftime("%d/%m/%Y %H:%M:%S")},
+	}
+	items = client.post("PagePresence", 19, json_data)["dataSec"]["data"]["listeAbsences"]["V"]
+	presence = {
+		"absences": [pronotepy.Absence(item) for item in items if item["G"] == 13],
+		"delays": [pronotepy.Delay(item) for item in items if item["G"] == 14],
+		"punishments": [pronotepy.Punishment(client, item) for item in items if item["G"] == 41],
+	}
+
+	ttl = presence_closed_ttl if period.end < datetime.datetime.now() else presence_current_ttl
+	periodsPresence[period.id] = (time.time() + ttl, presence)
+	return presence
 
-		gradeReturn = {
-			"grades": gradesData,
-			"averages": averagesData,
-			"overall_average": __transform_to_number(__get_grade_state(client.calculated_period.overall_average)),
-			"class_overall_average": __transform_to_number(__get_grade_state(client.calculated_period.class_overall_average)),
-		}
+def __presence_items(client: pronotepy.Client, kind: str, allPeriods: bool) -> list:
+	"""
+	Récupère les absences, retards ou punitions de la période sélectionnée ou de toutes les périodes.
+	Seules les périodes dont le résultat n'est plus gardé interrogent Pronote. Le verrou du client doit être acquis.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		kind (str): "absences", "delays" ou "punishments"
+		allPeriods (bool): Si toutes les périodes doivent être récupérées, sinon seulement la période sélectionnée
+		
+	Returns:
+		list: Les éléments demandés, période par période.
+	"""
+	
+	periods = client.activated_period if allPeriods else [__selected_period(client)]
+	return [item for period in periods for item in __period_presence(client, period)[kind]]
 
-		return gradeReturn
-	else:
-		response.status = falcon.get_http_status(498)
-		return success
 
+# voir /absences
+absence_schema = Schema({
+	"id": "id",
+	"from": __date_field("from_date"),
+	"to": __date_field("to_date"),
+	"justified": "justified",
+	"hours": "hours",
+	"reasons": "reasons",
+})
 
 @hug.get('/absences')
-def absences(token: str, response, allPeriods: bool = True):
+def absences(token: str, response, allPeriods: bool = True, fields: str = None, exclude: str = None):
 	"""
 	Récupère les absences de l'utilisateur.
 	
@@ -719,6 +2696,8 @@ def absences(token: str, response, allPeriods: bool = True):
 		token (str): Le token du client Pronote
 		response (falcon.Response): La réponse de la requête
 		allPeriods (bool): Si toutes les périodes doivent être récupérées. Par défaut, toutes les périodes sont récupérées.
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
 		list[dict]: Les informations des absences :
@@ -735,32 +2714,29 @@ def absences(token: str, response, allPeriods: bool = True):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		if allPeriods:
-			allAbsences = [absence for period in client.activated_period for absence in period.absences]
-		else:
-			allAbsences = client.calculated_period.absences
-
-		absencesData = []
-		for absence in allAbsences:
-			absenceData = {
-				"id": absence.id,
-				"from": absence.from_date.strftime("%Y-%m-%d %H:%M"),
-				"to": absence.to_date.strftime("%Y-%m-%d %H:%M"),
-				"justified": absence.justified,
-				"hours": absence.hours,
-				"reasons": absence.reasons,
-			}
-
-			absencesData.append(absenceData)
+		schema, projection = __projection(absence_schema, fields, exclude)
+		def fetch_absences():
+			allAbsences = __presence_items(client, 'absences', allPeriods)
+			return schema.dump_many(allAbsences)
 
-		return absencesData
+		return __fetch(token, client, 'absences', {'allPeriods': allPeriods, **projection}, fetch_absences)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
 
+# voir /delays
+delay_schema = Schema({
+	"id": "id",
+	"date": __date_field("date"),
+	"duration": "minutes",
+	"justified": "justified",
+	"justification": "justification",
+	"reasons": "reasons",
+})
+
 @hug.get('/delays')
-def delays(token: str, response, allPeriods: bool = True):
+def delays(token: str, response, allPeriods: bool = True, fields: str = None, exclude: str = None):
 	"""
 	Récupère les retards de l'utilisateur.
 	
@@ -768,6 +2744,8 @@ def delays(token: str, response, allPeriods: bool = True):
 		token (str): Le token du client Pronote
 		response (falcon.Response): La réponse de la requête
 		allPeriods (bool): Si toutes les périodes doivent être récupérées. Par défaut, toutes les périodes sont récupérées.
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
 		list[dict]: Les informations des retards :
@@ -784,32 +2762,45 @@ def delays(token: str, response, allPeriods: bool = True):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		if allPeriods:
-			allDelays = [delay for period in client.activated_period for delay in period.delays]
-		else:
-			allDelays = client.calculated_period.delays
-		
-		delaysData = []
-		for delay in allDelays:
-			delayData = {
-				"id": delay.id,
-				"date": delay.date.strftime("%Y-%m-%d %H:%M"),
-				"duration": delay.minutes,
-				"justified": delay.justified,
-				"justification": delay.justification,
-				"reasons": delay.reasons,
-			}
-
-			delaysData.append(delayData)
+		schema, projection = __projection(delay_schema, fields, exclude)
+		def fetch_delays():
+			allDelays = __presence_items(client, 'delays', allPeriods)
+			return schema.dump_many(allDelays)
 
-		return delaysData
+		return __fetch(token, client, 'delays', {'allPeriods': allPeriods, **projection}, fetch_delays)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
 
+# voir /punishments
+punishment_schema = Schema({
+	"id": "id",
+	"schedulable": "schedulable",
+	"schedule": __list_field("schedule", Schema({
+		"id": "id",
+		"start": __date_field("start"),
+		"duration": "duration",
+	})),
+	"date": __date_field("given"),
+	"given_by": "giver",
+	"exclusion": "exclusion",
+	"during_lesson": "during_lesson",
+	"homework": __object_field(Schema({
+		"text": "homework",
+		"documents": __list_field("homework_documents", attachment_schema),
+	})),
+	"reason": __object_field(Schema({
+		"text": "reasons",
+		"circumstances": "circumstances",
+		"documents": __list_field("circumstance_documents", attachment_schema),
+	})),
+	"nature": "nature",
+	"duration": "duration",
+})
+
 @hug.get('/punishments')
-def punishments(token: str, response, allPeriods: bool = True):
+def punishments(token: str, response, allPeriods: bool = True, fields: str = None, exclude: str = None):
 	"""
 	Récupère les punitions de l'utilisateur.
 	
@@ -817,6 +2808,8 @@ def punishments(token: str, response, allPeriods: bool = True):
 		token (str): Le token du client Pronote
 		response (falcon.Response): La réponse de la requête
 		allPeriods (bool): Si toutes les périodes doivent être récupérées. Par défaut, toutes les périodes sont récupérées.
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
 		list[dict]: Les informations des punitions :
@@ -860,79 +2853,43 @@ def punishments(token: str, response, allPeriods: bool = True):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		if allPeriods:
-			allPunishments = [punishment for period in client.activated_period for punishment in period.punishments]
-		else:
-			allPunishments = client.calculated_period.punishments
-		
-		punishmentsData = []
-		for punishment in allPunishments:
-			homeworkDocs = []
-			if punishment.homework_documents is not None:
-				for homeworkDoc in punishment.homework_documents:
-					homeworkDocs.append({
-						"id": homeworkDoc.id,
-						"name": homeworkDoc.name,
-						"url": homeworkDoc.url,
-						"type": homeworkDoc.type
-					})
-
-			circumstanceDocs = []
-			if punishment.circumstance_documents is not None:
-				for circumstanceDoc in punishment.circumstance_documents:
-					circumstanceDocs.append({
-						"id": circumstanceDoc.id,
-						"name": circumstanceDoc.name,
-						"url": circumstanceDoc.url,
-						"type": circumstanceDoc.type
-					})
-
-			schedules = []
-			if punishment.schedule is not None:
-				for schedule in punishment.schedule:
-					schedules.append({
-						"id": schedule.id,
-						"start": schedule.start.strftime("%Y-%m-%d %H:%M"),
-						"duration": schedule.duration,
-					})
-
-			punishmentData = {
-				"id": punishment.id,
-				"schedulable": punishment.schedulable,
-				"schedule": schedules,
-				"date": punishment.given.strftime("%Y-%m-%d %H:%M"),
-				"given_by": punishment.giver,
-				"exclusion": punishment.exclusion,
-				"during_lesson": punishment.during_lesson,
-				"homework": {
-					"text": punishment.homework,
-					"documents": homeworkDocs,
-				},
-				"reason": {
-					"text": punishment.reasons,
-					"circumstances": punishment.circumstances,
-					"documents": circumstanceDocs,
-				},
-				"nature": punishment.nature,
-				"duration": punishment.duration
-			}
-
-			punishmentsData.append(punishmentData)
+		schema, projection = __projection(punishment_schema, fields, exclude)
+		def fetch_punishments():
+			allPunishments = __presence_items(client, 'punishments', allPeriods)
+			return schema.dump_many(allPunishments)
 
-		return punishmentsData
+		return __fetch(token, client, 'punishments', {'allPeriods': allPeriods, **projection}, fetch_punishments)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
 
+# voir /news
+news_schema = Schema({
+	"id": "id",
+	"title": "title",
+	"date": __date_field("creation_date"),
+	"category": "category",
+	"read": "read",
+	"survey": "survey",
+	"anonymous_survey": "anonymous_response",
+	"author": "author",
+	"content": "content",
+	"attachments": __list_field("attachments", attachment_schema),
+	"html_content": "_raw_content",
+})
+
 @hug.get('/news')
-def news(token: str, response):
+def news(token: str, response, fields: str = None, exclude: str = None, since: str = None):
 	"""
 	Récupère les actualités de l'utilisateur.
 	
 	Args:
 		token (str): Le token du client Pronote
 		response (falcon.Response): La réponse de la requête
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
+		since (str, optional): Le curseur (en-tête X-Sync-Cursor) d'une réponse précédente, pour ne recevoir que les changements depuis (voir __sync)
 		
 	Returns:
 		list[dict]: Les informations des actualités :
@@ -959,50 +2916,48 @@ def news(token: str, response):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		allNews = client.information_and_surveys()
-
-		newsAllData = []
-		for news in allNews:
-			attachments = []
-			if news.attachments is not None:
-				for attachment in news.attachments:
-					attachments.append({
-						"id": attachment.id,
-						"name": attachment.name,
-						"url": attachment.url,
-						"type": attachment.type
-					})
-
-			newsData = {
-				"id": news.id,
-				"title": news.title,
-				"date": news.creation_date.strftime("%Y-%m-%d %H:%M"),
-				"category": news.category,
-				"read": news.read,
-				"survey": news.survey,
-				"anonymous_survey": news.anonymous_response,
-				"author": news.author,
-				"content": news.content,
-				"attachments": attachments,
-				"html_content": news._raw_content
-			}
+		schema, projection = __projection(news_schema, fields, exclude)
+		def fetch_news():
+			allNews = client.information_and_surveys()
+			return schema.dump_many(allNews)
 
-			newsAllData.append(newsData)
-
-		return newsAllData
+		newsData = __fetch(token, client, 'news', projection, fetch_news)
+		return __sync(client, response, ('news', tuple(projection.items())), newsData, since, {None: operator.itemgetter('id')})
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
 
+# voir /discussions
+discussion_schema = Schema({
+	"id": "id",
+	"subject": "subject",
+	"creator": "creator",
+	"participants": "participants",
+	"date": __date_field("date"),
+	"unread": "unread",
+	"closed": "close",
+	"replyable": "replyable",
+	"messages": __list_field("messages", Schema({
+		"id": "id",
+		"content": "content",
+		"author": "author",
+		"date": __date_field("date"),
+		"seen": "seen",
+	})),
+})
+
 @hug.get('/discussions')
-def discussions(token: str, response):
+def discussions(token: str, response, fields: str = None, exclude: str = None, since: str = None):
 	"""
 	Récupère les discussions de l'utilisateur.
 	
 	Args:
 		token (str): Le token du client Pronote
 		response (falcon.Response): La réponse de la requête
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
+		since (str, optional): Le curseur (en-tête X-Sync-Cursor) d'une réponse précédente, pour ne recevoir que les changements depuis (voir __sync)
 		
 	Returns:
 		list[dict]: Les informations des discussions :
@@ -1027,40 +2982,40 @@ def discussions(token: str, response):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		allDiscussions = client.discussions()
-
-		discussionsAllData = []
-		for discussion in allDiscussions:
-			messages = []
-			for message in discussion.messages:
-				messages.append({
-					"id": message.id,
-					"content": message.content,
-					"author": message.author,
-					"date": message.date.strftime("%Y-%m-%d %H:%M") if message.date is not None else None,
-					"seen": message.seen
-				})
-
-			discussionData = {
-				"id": discussion.id,
-				"subject": discussion.subject,
-				"creator": discussion.creator,
-				"participants": discussion.participants,
-				"date": discussion.date.strftime("%Y-%m-%d %H:%M") if discussion.date is not None else None,
-				"unread": discussion.unread,
-				"closed": discussion.close,
-				"replyable": discussion.replyable,
-				"messages": messages,
-			}
+		schema, projection = __projection(discussion_schema, fields, exclude)
+		def fetch_discussions():
+			allDiscussions = client.discussions()
+			__client_state(client)['discussions'] = {discussion.id: discussion for discussion in allDiscussions}
 
-			discussionsAllData.append(discussionData)
+			return schema.dump_many(allDiscussions)
 
-		return discussionsAllData
+		discussionsData = __fetch(token, client, 'discussions', projection, fetch_discussions)
+		return __sync(client, response, ('discussions', tuple(projection.items())), discussionsData, since, {None: operator.itemgetter('id')})
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
 
+def __find_discussion(client: pronotepy.Client, discussionId: str) -> pronotepy.Discussion|None:
+	"""
+	Retrouve une discussion par son identifiant dans l'index du client, rempli par /discussions.
+	Les discussions ne sont retéléchargées que si l'identifiant n'est pas dans l'index. Le verrou du client doit être acquis.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		discussionId (str): L'identifiant de la discussion
+		
+	Returns:
+		pronotepy.Discussion|None: La discussion, ou None si elle n'existe pas.
+	"""
+	
+	state = __client_state(client)
+	index = state.get('discussions')
+	if index is None or discussionId not in index:
+		index = state['discussions'] = {discussion.id: discussion for discussion in client.discussions()}
+	return index.get(discussionId)
+
+
 @hug.post('/discussion/delete')
 def delete_discussion(token: str, discussionId: str, response):
 	"""
@@ -1078,20 +3033,22 @@ def delete_discussion(token: str, discussionId: str, response):
 	success, client = get_client(token)
 	if success == 'ok':
 		try:
-			allDiscussions = client.discussions()
-			for discussion in allDiscussions:
-				if discussion.id == discussionId:
-					discussion.delete()
-					return {
-						"status": "ok",
-						"error": None
-					}
-				else:
+			with __client_lock(client):
+				discussion = __find_discussion(client, discussionId)
+				if discussion is None:
 					response.status = falcon.get_http_status(404)
 					return {
 						"status": "not found",
 						"error": "La discussion n'a pas été trouvée."
 					}
+
+				discussion.delete()
+				__client_state(client)['discussions'].pop(discussionId, None)
+				__invalidate_client(token, 'discussions')
+				return {
+					"status": "ok",
+					"error": None
+				}
 		except Exception as e:
 			response.status = falcon.get_http_status(500)
 			return {
@@ -1119,21 +3076,27 @@ def read_discussion(token: str, discussionId: str, response):
 	success, client = get_client(token)
 	if success == 'ok':
 		try:
-			allDiscussions = client.discussions()
-			for discussion in allDiscussions:
-				if discussion.id == discussionId:
-					if discussion.unread == 0: discussion.mark_as(False)
-					else: discussion.mark_as(True)
-					return {
-						"status": "ok",
-						"error": None
-					}
-				else:
+			with __client_lock(client):
+				discussion = __find_discussion(client, discussionId)
+				if discussion is None:
 					response.status = falcon.get_http_status(404)
 					return {
 						"status": "not found",
 						"error": "La discussion n'a pas été trouvée."
 					}
+
+				# la discussion gardée dans l'index est mise à jour pour que le prochain changement parte du bon état
+				if discussion.unread == 0:
+					discussion.mark_as(False)
+					discussion.unread = 1
+				else:
+					discussion.mark_as(True)
+					discussion.unread = 0
+				__invalidate_client(token, 'discussions')
+				return {
+					"status": "ok",
+					"error": None
+				}
 		except Exception as e:
 			response.status = falcon.get_http_status(500)
 			return {
@@ -1162,27 +3125,28 @@ def reply_discussion(token: str, discussionId: str, content: str, response):
 	success, client = get_client(token)
 	if success == 'ok':
 		try:
-			allDiscussions = client.discussions()
-			for discussion in allDiscussions:
-				if discussion.id == discussionId:
-					if discussion.replyable:
-						discussion.reply(content)
-						return {
-							"status": "ok",
-							"error": None
-						}
-					else:
-						response.status = falcon.get_http_status(403)
-						return {
-							"status": "not replyable",
-							"error": "La discussion n'est pas ouverte à la réponse."
-						}
-				else:
+			with __client_lock(client):
+				discussion = __find_discussion(client, discussionId)
+				if discussion is None:
 					response.status = falcon.get_http_status(404)
 					return {
 						"status": "not found",
 						"error": "La discussion n'a pas été trouvée."
 					}
+
+				if discussion.replyable:
+					discussion.reply(content)
+					__invalidate_client(token, 'discussions')
+					return {
+						"status": "ok",
+						"error": None
+					}
+				else:
+					response.status = falcon.get_http_status(403)
+					return {
+						"status": "not replyable",
+						"error": "La discussion n'est pas ouverte à la réponse."
+					}
 		except Exception as e:
 			response.status = falcon.get_http_status(500)
 			return {
@@ -1194,14 +3158,48 @@ def reply_discussion(token: str, discussionId: str, content: str, response):
 		return success
 
 
+def __get_recipients(client: pronotepy.Client) -> dict[str, pronotepy.Recipient]:
+	"""
+	Récupère l'annuaire des destinataires du client, téléchargé une fois puis gardé cache_ttl['recipients'] secondes.
+	Le verrou du client doit être acquis.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		
+	Returns:
+		dict[str, pronotepy.Recipient]: Les destinataires par identifiant, dans l'ordre de Pronote.
+	"""
+	
+	state = __client_state(client)
+	directory = state.get('recipients')
+	if directory is None or directory[0] < time.time():
+		directory = state['recipients'] = (
+			time.time() + cache_ttl['recipients'],
+			{recipient.id: recipient for recipient in client.get_recipients()}
+		)
+	return directory[1]
+
+
+# voir /recipients
+recipient_schema = Schema({
+	"id": "id",
+	"name": "name",
+	"type": "type",
+	"email": "email",
+	"functions": "functions",
+	"with_discussion": "with_discussion",
+})
+
 @hug.get('/recipients')
-def recipients(token: str, response):
+def recipients(token: str, response, fields: str = None, exclude: str = None):
 	"""
 	Récupère la liste des destinataires possibles.
 	
 	Args:
 		token (str): Le token du client Pronote
 		response (falcon.Response): La réponse de la requête
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
 		list: La liste des destinataires possibles.
@@ -1218,22 +3216,12 @@ def recipients(token: str, response):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		allRecipients = client.get_recipients()
-
-		recipientsAllData = []
-		for recipient in allRecipients:
-			recipientData = {
-				"id": recipient.id,
-				"name": recipient.name,
-				"type": recipient.type,
-				"email": recipient.email,
-				"functions": recipient.functions,
-				"with_discussion": recipient.with_discussion
-			}
+		schema, projection = __projection(recipient_schema, fields, exclude)
+		def fetch_recipients():
+			allRecipients = __get_recipients(client).values()
+			return schema.dump_many(allRecipients)
 
-			recipientsAllData.append(recipientData)
-		
-		return recipientsAllData
+		return __fetch(token, client, 'recipients', projection, fetch_recipients)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
@@ -1258,32 +3246,31 @@ def create_discussion(token: str, subject: str, content: str, recipientsId: str,
 	success, client = get_client(token)
 	if success == 'ok':
 		try:
-			prn_recipients = []
-			for recipient in json.loads(recipientsId):
-				for prn_recipient in client.get_recipients():
-					if prn_recipient.id == recipient:
-						prn_recipients.append(prn_recipient)
+			with __client_lock(client):
+				directory = __get_recipients(client)
+				prn_recipients = [directory[recipient] for recipient in json.loads(recipientsId) if recipient in directory]
 						
-			if len(prn_recipients) == 0:
-				response.status = falcon.get_http_status(400)
-				return {
-					"status": "no recipient",
-					"error": "Aucun destinataire valide n'a été trouvé."
-				}
-				
-			for prn_recipient in prn_recipients:
-				if prn_recipient.with_discussion == False:
+				if len(prn_recipients) == 0:
 					response.status = falcon.get_http_status(400)
 					return {
-						"status": "recipient not accept discussion",
-						"error": "Un ou plusieurs destinataires n'acceptent pas les discussions."
+						"status": "no recipient",
+						"error": "Aucun destinataire valide n'a été trouvé."
 					}
+				
+				for prn_recipient in prn_recipients:
+					if prn_recipient.with_discussion == False:
+						response.status = falcon.get_http_status(400)
+						return {
+							"status": "recipient not accept discussion",
+							"error": "Un ou plusieurs destinataires n'acceptent pas les discussions."
+						}
 					
-			client.new_discussion(subject, content, prn_recipients)
-			return {
-				"status": "ok",
-				"error": None
-			}
+				client.new_discussion(subject, content, prn_recipients)
+				__invalidate_client(token, 'discussions')
+				return {
+					"status": "ok",
+					"error": None
+				}
 		except Exception as e:            
 			response.status = falcon.get_http_status(500)
 			return {
@@ -1295,17 +3282,41 @@ def create_discussion(token: str, subject: str, content: str, recipientsId: str,
 		return success
 
 
+# voir /evaluations
+evaluation_schema = Schema({
+	"id": "id",
+	"subject": __subject_field(),
+	"name": "name",
+	"description": "description",
+	"teacher": "teacher",
+	"date": __date_field("date"),
+	"paliers": "paliers",
+	"coefficient": "coefficient",
+	"acquisitions": __list_field("acquisitions", Schema({
+		"id": "id",
+		"name": "name",
+		"coefficient": "coefficient",
+		"abbreviation": "abbreviation",
+		"domain": "domain",
+		"level": "level",
+	})),
+})
+
 @hug.get('/evaluations')
-def evaluations(token: str, response):
+def evaluations(token: str, response, period: str = None, periods: str = None, fields: str = None, exclude: str = None):
 	"""
 	Permet de récupérer les évaluations.
 	
 	Args:
 		token (str): Le token du client Pronote
 		response (falcon.Response): La réponse de la requête
+		period (str, optional): Le nom de la période, la période sélectionnée si absent
+		periods (str, optional): "all" ou des noms de périodes séparés par des virgules, pour obtenir plusieurs périodes à la fois
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
-		list[dict]: La liste des évaluations.
+		list[dict]: La liste des évaluations (avec periods, un dict nom de période -> liste des évaluations).
 		
 		[{
 			"id": str,
@@ -1333,92 +3344,50 @@ def evaluations(token: str, response):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		allEvaluations = client.calculated_period.evaluations
-
-		evaluationsAllData = []
-		for evaluation in allEvaluations:
-			acquisitions = []
-			if evaluation.acquisitions is not None:
-				for acquisition in evaluation.acquisitions:
-					acquisitions.append({
-						"id": acquisition.id,
-						"name": acquisition.name,
-						"coefficient": acquisition.coefficient,
-						"abbreviation": acquisition.abbreviation,
-						"domain": acquisition.domain,
-						"level": acquisition.level
-					})
-
-			evaluationData = {
-				"id": evaluation.id,
-				"subject": {
-					"id": evaluation.subject.id,
-					"name": evaluation.subject.name,
-					"groups": evaluation.subject.groups,
-				},
-				"name": evaluation.name,
-				"description": evaluation.description,
-				"teacher": evaluation.teacher,
-				"date": evaluation.date.strftime("%Y-%m-%d %H:%M"),
-				"paliers": evaluation.paliers,
-				"coefficient": evaluation.coefficient,
-				"acquisitions": acquisitions,
-			}
+		schema, projection = __projection(evaluation_schema, fields, exclude)
+		def fetch_evaluations(period):
+			allEvaluations = period.evaluations
+			return schema.dump_many(allEvaluations)
 
-			evaluationsAllData.append(evaluationData)
+		selected = __requested_periods(client, period, periods)
+		if selected is None:
+			return __unknown_period(response)
 
-		return evaluationsAllData
+		evaluationsByPeriod = {period.name: __fetch(token, client, 'evaluations', {'period': period.id, **projection}, lambda period=period: fetch_evaluations(period)) for period in selected}
+		return evaluationsByPeriod if periods is not None else evaluationsByPeriod[selected[0].name]
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
-def __get_meal_food(meal: list[dict]):
-	"""
-	Permet de récupérer les aliments d'un repas.
-	
-	Args:
-		meal (list): La liste des aliments du repas
-		
-	Returns:
-		list[dict]: La liste des aliments du repas.
-	"""
-	
-	if meal is None:
-		return None
-	else:
-		foods = []
-		for food in meal:
-			foods.append({
-				"name": food.name,
-				"labels": __get_food_labels(food.labels),
-			})
-		return foods
-
-def __get_food_labels(labels: list[dict]):
-	"""
-	Permet de récupérer les labels d'un aliment.
-	
-	Args:
-		labels (list): La liste des labels de l'aliment
-		
-	Returns:
-		list[dict]: La liste des labels de l'aliment.
-	"""
-	
-	if labels is None:
-		return None
-	else:
-		foodLabels = []
-		for label in labels:
-			foodLabels.append({
-				"id": label.id,
-				"name": label.name,
-				"color": label.color,
-			})
-		return foodLabels
+# aliments d'un repas, voir /menu
+food_schema = Schema({
+	"name": "name",
+	"labels": __list_field("labels", Schema({
+		"id": "id",
+		"name": "name",
+		"color": "color",
+	}), keep_none=True),
+})
+
+# voir /menu
+menu_schema = Schema({
+	"id": "id",
+	"name": "name",
+	"date": __date_field("date", day_format),
+	"type": __object_field(Schema({
+		"is_lunch": "is_lunch",
+		"is_dinner": "is_dinner",
+	})),
+	"first_meal": __list_field("first_meal", food_schema, keep_none=True),
+	"dessert": __list_field("dessert", food_schema, keep_none=True),
+	"cheese": __list_field("cheese", food_schema, keep_none=True),
+	"other_meal": __list_field("other_meal", food_schema, keep_none=True),
+	"side_meal": __list_field("side_meal", food_schema, keep_none=True),
+	"main_meal": __list_field("main_meal", food_schema, keep_none=True),
+})
 
 @hug.get('/menu')
-def menu(token: str, dateFrom: str, dateTo: str, response):
+def menu(token: str, dateFrom: str, dateTo: str, response, fields: str = None, exclude: str = None):
 	"""
 	Permet de récupérer les menus.
 	
@@ -1427,6 +3396,8 @@ def menu(token: str, dateFrom: str, dateTo: str, response):
 		dateFrom (str): La date de début
 		dateTo (str): La date de fin
 		response (falcon.Response): La réponse de la requête
+		fields (str, optional): Les champs à renvoyer pour chaque élément, séparés par des virgules (tous si absent)
+		exclude (str, optional): Les champs à ne pas renvoyer pour chaque élément, séparés par des virgules
 		
 	Returns:
 		list[dict]: La liste des menus.
@@ -1452,36 +3423,12 @@ def menu(token: str, dateFrom: str, dateTo: str, response):
 	dateTo = datetime.datetime.strptime(dateTo, "%Y-%m-%d").date()
 	success, client = get_client(token)
 	if success == 'ok':
-		allMenus = client.menus(date_from=dateFrom, date_to=dateTo)
-
-		menusAllData = []
-		for menu in allMenus:
-			cheese = __get_meal_food(menu.cheese)
-			dessert = __get_meal_food(menu.dessert)
-			other_meal = __get_meal_food(menu.other_meal)
-			side_meal = __get_meal_food(menu.side_meal)
-			main_meal = __get_meal_food(menu.main_meal)
-			first_meal = __get_meal_food(menu.first_meal)
-
-			menuData = {
-				"id": menu.id,
-				"name": menu.name,
-				"date": menu.date.strftime("%Y-%m-%d"),
-				"type": {
-					"is_lunch": menu.is_lunch,
-					"is_dinner": menu.is_dinner,
-				},
-				"first_meal": first_meal,
-				"dessert": dessert,
-				"cheese": cheese,
-				"other_meal": other_meal,
-				"side_meal": side_meal,
-				"main_meal": main_meal,
-			}
-
-			menusAllData.append(menuData)
+		schema, projection = __projection(menu_schema, fields, exclude)
+		def fetch_menu():
+			allMenus = client.menus(date_from=dateFrom, date_to=dateTo)
+			return schema.dump_many(allMenus)
 
-		return menusAllData
+		return __fetch(token, client, 'menu', {'dateFrom': dateFrom, 'dateTo': dateTo, **projection}, fetch_menu)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
@@ -1501,53 +3448,86 @@ def export_ical(token: str, response):
 	
 	success, client = get_client(token)
 	if success == 'ok':
-		ical_url = client.export_ical()
-		return ical_url
+		return __fetch(token, client, 'export/ical', {}, client.export_ical)
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
 
 
+def __find_homework(client: pronotepy.Client, homeworkId: str, dateFrom: datetime.date = None, dateTo: datetime.date = None) -> pronotepy.Homework|None:
+	"""
+	Retrouve un devoir par son identifiant dans l'index du client, rempli par /homework.
+	Si le devoir n'y est pas et que les dates sont données, les devoirs entre ces dates sont téléchargés et ajoutés à l'index.
+	Le verrou du client doit être acquis.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		homeworkId (str): L'ID du devoir
+		dateFrom (datetime.date, optional): La date de début des devoirs à télécharger si le devoir n'est pas dans l'index
+		dateTo (datetime.date, optional): La date de fin des devoirs à télécharger si le devoir n'est pas dans l'index
+		
+	Returns:
+		pronotepy.Homework|None: Le devoir, ou None s'il n'a pas été trouvé.
+	"""
+	
+	index = __client_state(client).setdefault('homework', {})
+	if homeworkId not in index and dateFrom is not None and dateTo is not None:
+		index.update((homework.id, homework) for homework in client.homework(date_from=dateFrom, date_to=dateTo))
+	return index.get(homeworkId)
+
+
 @hug.post('/homework/changeState')
-def set_homework_as_done(token: str, dateFrom: str, dateTo: str, homeworkId: str, response):
+def set_homework_as_done(token: str, homeworkId: str, response, dateFrom: str = None, dateTo: str = None, done: hug.types.smart_boolean = None):
 	"""
 	Change l'état d'un devoir. (fait ou non fait)
 	
 	Args:
 		token (str): Le token du client Pronote
-		dateFrom (str): La date de début
-		dateTo (str): La date de fin
 		homeworkId (str): L'ID du devoir
 		response (falcon.Response): La réponse de la requête
+		dateFrom (str, optional): La date de début, pour retrouver le devoir s'il n'a pas été obtenu avec /homework
+		dateTo (str, optional): La date de fin, pour retrouver le devoir s'il n'a pas été obtenu avec /homework
+		done (bool, optional): L'état à donner au devoir. Si absent, l'état actuel est inversé.
 		
 	Returns:
 		str: 'ok' si tout s'est bien passé, 'not found' si le devoir n'a pas été trouvé, 'error' si une erreur est survenue.
 	"""
 	
-	dateFrom = datetime.datetime.strptime(dateFrom, "%Y-%m-%d").date()
-	dateTo = datetime.datetime.strptime(dateTo, "%Y-%m-%d").date()
+	if dateFrom is not None and dateTo is not None:
+		dateFrom = datetime.datetime.strptime(dateFrom, "%Y-%m-%d").date()
+		dateTo = datetime.datetime.strptime(dateTo, "%Y-%m-%d").date()
 	success, client = get_client(token)
 
 	if success == 'ok':
 		if client.logged_in:
 			try:
-				homeworks = client.homework(date_from=dateFrom, date_to=dateTo)
-				
-				for homework in homeworks:
-					changed = False
-					if homework.id == homeworkId:
-						if homework.done: homework.set_done(False)
-						else: homework.set_done(True)
-						changed = True
+				with __client_lock(client):
+					homework = __find_homework(client, homeworkId, dateFrom, dateTo)
+					if homework is None:
+						response.status = falcon.get_http_status(404)
 						return {
-							"status": "ok",
-							"error": None
+							"status": "not found",
+							"error": "Aucun devoir trouvé avec cet ID."
 						}
-				if not changed:
-					response.status = falcon.get_http_status(404)
+
+					status = not homework.done if done is None else done
+					homework.set_done(status)
+
+					# met à jour les réponses de /homework en cache plutôt que de les retélécharger
+					for shared_token in __client_tokens(token):
+						for homeworksData in response_cache.values(shared_token, 'homework'):
+							for homeworkData in homeworksData:
+								if homeworkData.get('id') == homeworkId and 'done' in homeworkData:
+									homeworkData['done'] = status
+					# sans l'id (voir le paramètre fields), le devoir ne peut pas être retrouvé dans la réponse
+					__invalidate_client(token, 'homework', lambda params: 'id' not in homework_schema.project(params.get('fields'), params.get('exclude')).names)
+					# les réponses modifiées sur place gardaient leur curseur : __sync doit recalculer leurs empreintes
+					latest = __client_state(client).get('sync_latest', {})
+					for scope in [scope for scope in latest if scope[0] == 'homework']:
+						del latest[scope]
 					return {
-						"status": "not found",
-						"error": "Aucun devoir trouvé avec cet ID."
+						"status": "ok",
+						"error": None
 					}
 			except Exception as e:
 				response.status = falcon.get_http_status(500)
@@ -1558,3 +3538,439 @@ def set_homework_as_done(token: str, dateFrom: str, dateTo: str, homeworkId: str
 	else:
 		response.status = falcon.get_http_status(498)
 		return success
+
+
+# routes utilisables dans /batch (lecture seule)
+batch_routes = {
+	'user': user,
+	'timetable': timetable,
+	'content': content,
+	'homework': homework,
+	'grades': grades,
+	'evaluations': evaluations,
+	'absences': absences,
+	'delays': delays,
+	'punishments': punishments,
+	'news': news,
+	'discussions': discussions,
+	'recipients': recipients,
+	'menu': menu,
+	'export/ical': export_ical,
+}
+batch_max_requests = 20 # nombre maximal de sous-requêtes par appel à /batch
+batch_workers = 16 # nombre de sous-requêtes exécutées en parallèle, tous appels confondus
+batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix='batch')
+
+class BatchResponse:
+	"""Réponse d'une sous-requête de /batch, qui remplace falcon.Response auprès des routes."""
+
+	def __init__(self):
+		self.status = falcon.HTTP_200
+		self.headers = {}
+
+	def set_header(self, name: str, value: str):
+		self.headers[name] = value
+
+def __run_batch_item(token: str, item: dict) -> dict:
+	"""Exécute une sous-requête de /batch avec la route correspondante.
+
+	Args:
+		token (str): le jeton du client
+		item (dict): la sous-requête, sous la forme { "endpoint": str, "params": dict }
+
+	Returns:
+		dict: { "endpoint": str, "status": int, "headers": dict[str, str], "data": any }
+	"""
+	endpoint = str(item.get('endpoint', '')).strip('/') if isinstance(item, dict) else ''
+	route = batch_routes.get(endpoint)
+	if route is None:
+		return {
+			"endpoint": endpoint,
+			"status": 404,
+			"headers": {},
+			"data": {"status": "error", "error": f"Unknown endpoint {endpoint}"}
+		}
+
+	# mêmes conversions que hug applique aux paramètres d'une requête HTTP
+	transformations = route.interface.input_transformations
+	try:
+		params = item.get('params') or {}
+		if not isinstance(params, dict):
+			raise TypeError("params must be an object")
+		params = dict(params)
+		for name in list(params):
+			if name not in transformations or name in ('token', 'response'):
+				del params[name]
+			else:
+				params[name] = transformations[name](params[name])
+		for name in route.interface.required:
+			if name not in params and name not in ('token', 'response'):
+				raise ValueError(f"Missing {name}")
+	except (ValueError, TypeError) as e:
+		return {
+			"endpoint": endpoint,
+			"status": 400,
+			"headers": {},
+			"data": {"status": "error", "error": str(e)}
+		}
+
+	sub_response = BatchResponse()
+	outer_sessions = request_sessions.__dict__.pop('tokens', None)
+	try:
+		data = route(token=token, response=sub_response, **params)
+	except falcon.HTTPError as e:
+		sub_response.status = e.status
+		sub_response.headers.update(e.headers or {})
+		data = {"status": "error", "error": e.description or e.title}
+	except Exception as e:
+		sub_response.status = falcon.HTTP_500
+		data = {"status": "error", "error": str(e)}
+	finally:
+		# la session est réenregistrée par la requête /batch (ou l'interrogation de /events) elle-même
+		__end_sessions(persist=False)
+		if outer_sessions is not None:
+			request_sessions.tokens = outer_sessions
+
+	return {
+		"endpoint": endpoint,
+		"status": int(str(sub_response.status).split(' ')[0]),
+		"headers": sub_response.headers,
+		"data": data
+	}
+
+@hug.post('/batch')
+def batch(token: str, requests: list, response):
+	"""
+	Exécute plusieurs requêtes de lecture en un seul appel, en parallèle.
+	
+	Args:
+		token (str): Le token du client Pronote
+		requests (list): Les sous-requêtes, sous la forme [{ "endpoint": str, "params": dict }] (ex: { "endpoint": "homework", "params": { "dateFrom": "2023-01-02", "dateTo": "2023-01-08" } })
+		response (falcon.Response): La réponse de la requête
+		
+	Returns:
+		list[dict]: Le résultat de chaque sous-requête, dans l'ordre :
+		
+		[{
+			"endpoint": str,
+			"status": int,
+			"headers": dict[str, str] (les en-têtes de la réponse de la route, dont X-Sync-Cursor, Retry-After et l'ETag qu'aurait eu une requête GET),
+			"data": any
+		}]
+	"""
+	
+	if len(requests) > batch_max_requests:
+		response.status = falcon.get_http_status(400)
+		return {
+			"status": "error",
+			"error": f"Too many requests (max {batch_max_requests})"
+		}
+
+	success, client = get_client(token)
+	if success == 'ok':
+		futures = [batch_executor.submit(__run_batch_item, token, item) for item in requests]
+		# les sous-requêtes sont exécutées par d'autres threads : leur détail n'est pas mesuré
+		with timed('batch'):
+			results = [future.result() for future in futures]
+		# même ETag que la route appelée seule (voir conditional_get) : le client peut revalider chaque réponse sur sa route
+		for result in results:
+			if result['status'] == 200:
+				result['headers']['ETag'] = f'W/"{__etag(json_output(result["data"]))}"'
+		return results
+	else:
+		response.status = falcon.get_http_status(498)
+		return success
+
+# préchargement, après /generatetoken, des routes que l'application demande juste après la connexion
+prefetch_by_default = False # si True, /generatetoken précharge prefetch_endpoints même si le client ne le demande pas
+prefetch_endpoints = ['user', 'timetable', 'homework', 'grades'] # routes préchargées (voir batch_routes), dans cet ordre
+prefetch_params = {
+	'timetable': lambda today: {'dateString': today.isoformat()},
+	'homework': lambda today: {'dateFrom': (today - datetime.timedelta(days=today.weekday())).isoformat(), 'dateTo': (today + datetime.timedelta(days=6 - today.weekday())).isoformat()},
+	'menu': lambda today: {'dateFrom': (today - datetime.timedelta(days=today.weekday())).isoformat(), 'dateTo': (today + datetime.timedelta(days=6 - today.weekday())).isoformat()},
+	'content': lambda today: {'dateString': today.isoformat()},
+} # paramètres des routes préchargées, selon la date du jour (aujourd'hui, ou la semaine en cours)
+
+def __prefetch_endpoints(prefetch) -> list[str]:
+	"""
+	Interprète le paramètre prefetch de /generatetoken.
+	
+	Args:
+		prefetch (bool|str|list|None): True pour précharger prefetch_endpoints, ou la liste des routes à précharger. prefetch_by_default si absent.
+		
+	Returns:
+		list[str]: Les routes à précharger. Les noms de routes inconnus sont ignorés.
+		
+	Raises:
+		ValueError: si prefetch n'est ni un booléen ni une liste de noms de routes.
+	"""
+	
+	if prefetch is None:
+		return prefetch_endpoints if prefetch_by_default else []
+	if isinstance(prefetch, list):
+		if not all(isinstance(endpoint, str) for endpoint in prefetch):
+			raise ValueError("prefetch must be a boolean or a list of endpoint names")
+		return [endpoint for endpoint in prefetch if endpoint in batch_routes]
+	try:
+		return prefetch_endpoints if hug.types.smart_boolean(prefetch) else []
+	except (KeyError, ValueError, AttributeError, TypeError):
+		raise ValueError("prefetch must be a boolean or a list of endpoint names")
+
+def __prefetch(token: str, endpoints: list[str]):
+	"""
+	Précharge des routes dans le cache, en arrière-plan avec les sous-requêtes de /batch.
+	Les requêtes du client qui arrivent pendant le préchargement rejoignent les appels en cours (voir SingleFlight) au lieu de les refaire.
+	Désactivé avec un stockage de sessions partagé : la requête suivante peut arriver dans un autre processus, et deux copies d'une même session ne doivent pas interroger Pronote en même temps.
+	
+	Args:
+		token (str): Le jeton de la session
+		endpoints (list[str]): Les routes à précharger (voir batch_routes)
+	"""
+	
+	if session_store.shared:
+		return
+	today = datetime.date.today()
+	for endpoint in endpoints:
+		params = prefetch_params[endpoint](today) if endpoint in prefetch_params else {}
+		batch_executor.submit(__run_batch_item, token, {'endpoint': endpoint, 'params': params})
+
+# flux d'événements (SSE) : les sessions abonnées à /events sont interrogées régulièrement, seuls les changements sont envoyés
+events_endpoints = ['grades', 'news', 'discussions'] # routes surveillées (elles doivent accepter since, voir __sync)
+events_min_interval = 60 # intervalle minimal en sec entre deux interrogations d'une session, après un changement
+events_max_interval = 600 # intervalle maximal en sec, atteint en doublant l'intervalle tant que rien ne change
+events_max_polls_per_second = 5 # nombre maximal de sessions interrogées par seconde, toutes sessions confondues
+events_keepalive = 15 # temps en sec sans événement après lequel un commentaire est envoyé pour garder la connexion ouverte
+events_queue_size = 100 # nombre maximal d'événements en attente par flux
+events_workers = 4 # nombre de sessions interrogées en parallèle
+
+class EventStream:
+	"""
+	Flux SSE d'un abonné à /events, lu par falcon avec read() : chaque lecture attend un événement, ou renvoie un commentaire après events_keepalive secondes.
+	
+	Attributes:
+		token (str): Le jeton de la session
+		last_read (float): Le moment de la dernière lecture (time.time()), pour oublier les flux que plus personne ne lit
+		closed (bool): Si le flux est terminé
+	"""
+
+	def __init__(self, token: str):
+		self.token = token
+		self.events = collections.deque(maxlen=events_queue_size)
+		self.condition = threading.Condition()
+		self.last_read = time.time()
+		self.closed = False
+
+	def push(self, event: str, data):
+		"""Ajoute un événement au flux."""
+		with self.condition:
+			self.events.append(b'event: ' + event.encode() + b'\ndata: ' + json_output(data) + b'\n\n')
+			self.condition.notify()
+
+	def close(self):
+		"""Termine le flux : la lecture en cours renvoie les derniers événements, puis b''. Appelé aussi par falcon quand le client se déconnecte."""
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+
+	def read(self, size: int = -1) -> bytes:
+		with self.condition:
+			self.last_read = time.time()
+			if not self.events and not self.closed:
+				self.condition.wait(events_keepalive)
+			if self.events:
+				data = b''.join(self.events)
+				self.events.clear()
+				return data
+			if self.closed:
+				return b''
+			return b': keepalive\n\n'
+
+class EventScheduler:
+	"""
+	Interroge les sessions abonnées à /events. Chaque session n'a qu'une interrogation prévue, partagée par tous ses flux,
+	et ses routes y sont demandées avec le curseur de la fois précédente (voir __sync).
+	
+	Args:
+		poll (Callable): La fonction qui interroge une session, poll(token, cursors) -> bool (True si quelque chose a changé), elle met à jour cursors
+		
+	Attributes:
+		sessions (dict[str, dict]): Jeton -> { streams: set[EventStream], cursors: dict[str, str], interval: float }
+	"""
+
+	def __init__(self, poll):
+		self.poll = poll
+		self.sessions = {}
+		self.due = [] # tas de (moment de l'interrogation, jeton)
+		self.condition = threading.Condition()
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=events_workers, thread_name_prefix='events')
+		self.polls = 0
+		self.thread = None
+
+	def subscribe(self, stream: EventStream):
+		"""Abonne un flux ; la session est interrogée tout de suite si elle n'était pas encore surveillée."""
+		with self.condition:
+			session = self.sessions.get(stream.token)
+			if session is None:
+				session = self.sessions[stream.token] = {'streams': set(), 'cursors': {}, 'interval': events_min_interval}
+				heapq.heappush(self.due, (time.time(), stream.token))
+			session['streams'].add(stream)
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run, name='events-scheduler', daemon=True)
+				self.thread.start()
+			self.condition.notify()
+
+	def publish(self, token: str, event: str, data):
+		"""Envoie un événement à tous les flux d'une session."""
+		with self.condition:
+			streams = list(self.sessions.get(token, {}).get('streams', ()))
+		for stream in streams:
+			stream.push(event, data)
+
+	def end(self, token: str, event: str = None, data = None):
+		"""Envoie un dernier événement à tous les flux d'une session, puis les termine."""
+		with self.condition:
+			session = self.sessions.pop(token, None)
+		if session is not None:
+			for stream in session['streams']:
+				if event is not None:
+					stream.push(event, data)
+				stream.close()
+
+	def stats(self) -> dict[str, int]:
+		with self.condition:
+			return {
+				'sessions': len(self.sessions),
+				'streams': sum(len(session['streams']) for session in self.sessions.values()),
+				'polls': self.polls
+			}
+
+	def run(self):
+		last_poll = 0.0
+		while True:
+			with self.condition:
+				while not self.due or self.due[0][0] > time.time():
+					self.condition.wait(self.due[0][0] - time.time() if self.due else None)
+				_, token = heapq.heappop(self.due)
+				session = self.sessions.get(token)
+				if session is None:
+					continue
+				# oublie les flux fermés ou que plus personne ne lit
+				stale = time.time() - 2 * events_keepalive - 5
+				session['streams'] = {stream for stream in session['streams'] if not stream.closed and stream.last_read > stale}
+				if not session['streams']:
+					del self.sessions[token]
+					continue
+				self.polls += 1
+
+			# limite globale du nombre d'interrogations par seconde
+			wait = last_poll + 1 / events_max_polls_per_second - time.time()
+			if wait > 0:
+				time.sleep(wait)
+			last_poll = time.time()
+			self.executor.submit(self.run_poll, token, session)
+
+	def run_poll(self, token: str, session: dict):
+		try:
+			changed = self.poll(token, session['cursors'])
+		except Exception as e:
+			print(f"WARN: Couldn't poll events: {e}")
+			changed = False
+		with self.condition:
+			if self.sessions.get(token) is not session:
+				return
+			session['interval'] = events_min_interval if changed else min(session['interval'] * 2, events_max_interval)
+			heapq.heappush(self.due, (time.time() + session['interval'], token))
+			self.condition.notify()
+
+def __delta_has_changes(delta: dict) -> bool:
+	"""Si une réponse de __sync (ou une de ses listes) contient des changements."""
+	return any(
+		delta[key] if key in ('added', 'changed', 'removed') else isinstance(delta[key], dict) and __delta_has_changes(delta[key])
+		for key in delta
+	)
+
+def __poll_events(token: str, cursors: dict) -> bool:
+	"""
+	Interroge les routes events_endpoints d'une session avec leurs curseurs, et envoie un événement par route qui a changé.
+	La première interrogation (ou un curseur expiré) ne fait que mémoriser le curseur.
+	Les interrogations ne comptent pas comme des interactions : un flux ouvert ne garde pas en vie une session inutilisée,
+	il se termine par l'événement expired quand elle expire.
+	
+	Args:
+		token (str): Le jeton de la session
+		cursors (dict[str, str]): Route -> curseur de la dernière interrogation, mis à jour
+		
+	Returns:
+		bool: True si au moins une route a changé.
+	"""
+	
+	if session_store.shared:
+		try:
+			__begin_session(token)
+		except falcon.HTTPServiceUnavailable:
+			# la session est utilisée par un autre processus, elle sera interrogée au prochain tour
+			return False
+	
+	changed = False
+	request_sessions.polling = True
+	try:
+		for endpoint in events_endpoints:
+			result = __run_batch_item(token, {'endpoint': endpoint, 'params': {'since': cursors.get(endpoint, '')}})
+			if result['status'] == 498:
+				event_scheduler.end(token, 'expired', {'status': 'expired'})
+				return False
+			if result['status'] != 200:
+				continue
+			
+			delta = result['data']
+			cursors[endpoint] = delta.pop('cursor')
+			reset = delta.pop('reset')
+			if not reset and __delta_has_changes(delta):
+				event_scheduler.publish(token, endpoint, delta)
+				changed = True
+	finally:
+		request_sessions.polling = False
+		__end_sessions()
+	return changed
+
+event_scheduler = EventScheduler(__poll_events)
+
+@hug.output_format.content_type('text/event-stream')
+def event_stream_output(content, request=None, response=None):
+	"""Laisse falcon lire le flux ; les erreurs sont encodées en JSON."""
+	if hasattr(content, 'read'):
+		return content
+	response.content_type = 'application/json; charset=utf-8'
+	return json_output(content, request, response)
+
+@hug.get('/events', output=event_stream_output)
+def events(token: str, response):
+	"""
+	Ouvre un flux d'événements (Server-Sent Events) sur les changements des notes, actualités et discussions.
+	La session est interrogée tant que le flux est ouvert, plus souvent quand les données changent (voir events_min_interval et events_max_interval).
+	Le flux ne prolonge pas la session : sans autre requête pendant client_timeout_threshold secondes, elle expire et le flux se termine.
+	
+	Args:
+		token (str): Le token du client Pronote
+		response (falcon.Response): La réponse de la requête
+		
+	Returns:
+		EventStream: Le flux d'événements, de la forme :
+		
+		event: grades | news | discussions
+		data: les changements, comme la réponse de la route avec since (sans cursor ni reset)
+		
+		event: expired (la session a expiré, le flux se termine)
+		data: {"status": "expired"}
+	"""
+	
+	success, client = get_client(token)
+	if success == 'ok':
+		stream = EventStream(token)
+		event_scheduler.subscribe(stream)
+		response.set_header('Cache-Control', 'no-cache')
+		response.set_header('X-Accel-Buffering', 'no')
+		return stream
+	else:
+		response.status = falcon.get_http_status(498)
+		return success
@@ -1,86 +1,383 @@
-import requests, time
-
-print('Testeur papillon-python')
-api_url = input('URL de l\'API (http://127.0.0.1:8000) $ ')
-if api_url == '':
-    api_url = 'http://127.0.0.1:8000'
-pronote_url = input('URL de Pronote $ ')
-username = input('Nom d\'utilisateur $ ')
-password = input('Mot de passe $ ')
-ent = input('Code de l\'ENT $ ')
-
-response = requests.post(api_url.rstrip('/') + '/generatetoken', data={'url': pronote_url, 'username': username, 'password': password, 'ent': ent})
-print('login effectué')
-token = response.json()
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/user', params={'token': token})
-end = time.time()
-print(f'/user ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/timetable', params={'token': token, 'dateString': '2022-01-05'})
-end = time.time()
-print(f'/timetable ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/homework', params={'token': token, 'dateFrom': '2022-01-05', 'dateTo': '2022-01-09'})
-end = time.time()
-print(f'/homework ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/grades', params={'token': token})
-end = time.time()
-print(f'/grades ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/absences', params={'token': token})
-end = time.time()
-print(f'/absences ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/news', params={'token': token})
-end = time.time()
-print(f'/news ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/discussions', params={'token': token})
-end = time.time()
-print(f'/discussions ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
-
-start = time.time()
-response = requests.get(api_url.rstrip('/') + '/export/ical', params={'token': token})
-end = time.time()
-print(f'/export/ical ({round((end-start)*1000)}ms):')
-try:
-    print(response.json())
-except:
-    print('fail')
\ No newline at end of file
+"""
+Banc d'essai hors ligne de papillon-python.
+
+Le faux client Pronote de fake_pronote.py est injecté dans saved_clients, puis chaque route est appelée dans le
+processus avec le client de test de hug. Pour chaque route : débit, latences (moyenne, p50, p90, p99, max) et erreurs,
+avec le cache des réponses (warm) et sans (cold). Les latences sont celles mesurées par le serveur (durée totale de
+l'en-tête Server-Timing) : hug.test reconstruit l'application à chaque appel, ce qui fausserait une mesure de bout en bout.
+Avant les mesures, des vérifications contrôlent quelques comportements du serveur (python test.py --checks-only pour
+ne faire qu'elles). Les résultats sont enregistrés en JSON, et peuvent être comparés à ceux d'une version précédente :
+
+    python test.py --grades 5000 --output avant.json
+    python test.py --grades 5000 --compare avant.json
+"""
+import argparse, datetime, gc, heapq, json, os, platform, re, sys, threading, time
+
+import falcon.testing
+import hug
+import pronotepy
+import server
+from fake_pronote import FakeClient, install_client, make_sizes, sizes, start_day
+
+# (nom, méthode, route, paramètres de la i-ème requête) ; /events n'est pas mesurée : le flux ne se termine pas
+week = {'dateFrom': f'{start_day}', 'dateTo': f'{start_day + datetime.timedelta(days=6)}'}
+month = {'dateFrom': f'{start_day}', 'dateTo': f'{start_day + datetime.timedelta(days=27)}'}
+endpoints = [
+    ('infos', 'GET', '/infos', lambda i: {}),
+    ('metrics', 'GET', '/metrics', lambda i: {}),
+    ('user', 'GET', '/user', lambda i: {}),
+    ('timetable (jour)', 'GET', '/timetable', lambda i: {'dateString': f'{start_day}'}),
+    ('timetable (semaine)', 'GET', '/timetable', lambda i: week),
+    ('content', 'GET', '/content', lambda i: {'dateString': f'{start_day}'}),
+    ('homework', 'GET', '/homework', lambda i: month),
+    ('grades', 'GET', '/grades', lambda i: {}),
+    ('grades (toutes les périodes)', 'GET', '/grades', lambda i: {'periods': 'all'}),
+    ('grades (fields)', 'GET', '/grades', lambda i: {'fields': 'id,grade'}),
+    ('evaluations', 'GET', '/evaluations', lambda i: {}),
+    ('absences', 'GET', '/absences', lambda i: {}),
+    ('delays', 'GET', '/delays', lambda i: {}),
+    ('punishments', 'GET', '/punishments', lambda i: {}),
+    ('news', 'GET', '/news', lambda i: {}),
+    ('discussions', 'GET', '/discussions', lambda i: {}),
+    ('recipients', 'GET', '/recipients', lambda i: {}),
+    ('menu', 'GET', '/menu', lambda i: week),
+    ('export/ical', 'GET', '/export/ical', lambda i: {}),
+    ('changePeriod', 'POST', '/changePeriod', lambda i: {'periodName': 'Trimestre 2'}),
+    ('homework/changeState', 'POST', '/homework/changeState', lambda i: {'homeworkId': 'h0', **month}),
+    ('discussion/readState', 'POST', '/discussion/readState', lambda i: {'discussionId': 'd0'}),
+    ('discussion/reply', 'POST', '/discussion/reply', lambda i: {'discussionId': 'd0', 'content': 'Merci'}),
+    ('discussion/create', 'POST', '/discussion/create', lambda i: {'subject': 'Question', 'content': 'Bonjour', 'recipientsId': '["r1", "r2"]'}),
+    ('discussion/delete', 'POST', '/discussion/delete', lambda i: {'discussionId': 'd1'}),
+    ('batch', 'POST', '/batch', lambda i: {'requests': [{'endpoint': 'user'}, {'endpoint': 'homework', 'params': week}, {'endpoint': 'news'}]}),
+    ('generatetoken', 'POST', '/generatetoken', lambda i: {'url': 'https://demo.index-education.net/pronote/eleve.html', 'username': f'eleve{i}', 'password': 'papillon'}),
+]
+
+
+# réponses non compressées, pour que hug.test puisse les décoder
+get_headers = {'Accept': 'application/json', 'Accept-Encoding': 'identity'}
+post_headers = {**get_headers, 'Content-Type': 'application/json'}
+
+# vérifications, faites avant les mesures : chacune lève AssertionError en cas d'échec
+login = {'url': 'https://demo.index-education.net/pronote/eleve.html', 'password': 'papillon'}
+
+def wait_until(condition, timeout=5):
+    """Attend qu'une condition soit vraie (travail en arrière-plan du serveur), retourne son dernier résultat."""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def check_prefetch():
+    """Une connexion avec prefetch remplit le cache des réponses des routes demandées, et seulement avec prefetch."""
+    prefetched = ['user', 'news', 'recipients']
+    response = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'prefetch', 'prefetch': prefetched}, headers=post_headers)
+    token = response.data['token']
+    cached = lambda endpoint: server.response_cache.get(token, endpoint, {}) is not server.ResponseCache.MISSING
+    assert wait_until(lambda: all(cached(endpoint) for endpoint in prefetched)), f'routes non préchargées : {[endpoint for endpoint in prefetched if not cached(endpoint)]}'
+
+    response = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'sans-prefetch'}, headers=post_headers)
+    token = response.data['token']
+    server.batch_executor.submit(lambda: None).result()
+    assert not any(cached(endpoint) for endpoint in prefetched), 'routes préchargées sans prefetch'
+
+    # un prefetch invalide est refusé avant la connexion, sans laisser de session
+    sessions = len(server.saved_clients)
+    for prefetch in ([['news']], {'news': True}, 'peut-être', 2):
+        response = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'prefetch-invalide', 'prefetch': prefetch}, headers=post_headers)
+        assert response.status == '400 Bad Request', f'prefetch={prefetch!r} : {response.status}'
+    assert len(server.saved_clients) == sessions, 'session enregistrée malgré un prefetch invalide'
+
+def check_projections():
+    """fields et exclude ne s'appliquent qu'aux notes, averageFields et averageExclude aux moyennes ; /content accepte aussi fields."""
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'projections'}, headers=post_headers).data['token']
+    get = lambda url, **params: hug.test.call('GET', server, url, params={'token': token, **params}, headers=get_headers).data
+
+    data = get('/grades', fields='id,grade')
+    assert all(set(grade) == {'id', 'grade'} for grade in data['grades']), 'fields non appliqué aux notes'
+    assert data['averages'] and all(set(average) == set(server.average_schema.names) for average in data['averages']), 'fields appliqué aux moyennes'
+
+    data = get('/grades', averageFields='subject,average', exclude='description')
+    assert all(set(average) == {'subject', 'average'} for average in data['averages']), 'averageFields non appliqué'
+    assert all('description' not in grade and 'id' in grade for grade in data['grades']), 'exclude non appliqué aux notes'
+
+    data = get('/content', dateString=f'{start_day}', fields='title')
+    assert data and all(set(content) == {'title'} for content in data), 'fields non appliqué à /content'
+
+def check_homework_since():
+    """/homework renvoie un curseur, et avec since seulement les devoirs changés depuis, y compris par /homework/changeState."""
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'homework-since'}, headers=post_headers).data['token']
+    get = lambda **params: hug.test.call('GET', server, '/homework', params={'token': token, **month, **params}, headers=get_headers)
+
+    response = get()
+    cursor = response.headers_dict['x-sync-cursor']
+    delta = get(since=cursor).data
+    assert not delta['reset'] and not (delta['added'] or delta['changed'] or delta['removed']), f'changements inattendus : {delta}'
+
+    hug.test.call('POST', server, '/homework/changeState', body={'token': token, 'homeworkId': 'h0', 'done': True, **month}, headers=post_headers)
+    delta = get(since=cursor).data
+    assert [homework['id'] for homework in delta['changed']] == ['h0'] and delta['changed'][0]['done'], f'changement de h0 absent : {delta}'
+
+def check_shared_client():
+    """Deux connexions avec les mêmes identifiants partagent le client : la période choisie est gardée et les écritures invalident le cache des deux jetons."""
+    body = {**login, 'username': 'partage'}
+    first = hug.test.call('POST', server, '/generatetoken', body=body, headers=post_headers).data['token']
+    hug.test.call('POST', server, '/changePeriod', body={'token': first, 'periodName': 'Trimestre 3'}, headers=post_headers)
+    second = hug.test.call('POST', server, '/generatetoken', body=body, headers=post_headers).data['token']
+    assert server.saved_clients[first]['client'] is server.saved_clients[second]['client'], 'client non partagé'
+    assert server.saved_clients[second]['client'].calculated_period.name == 'Trimestre 3', 'période réinitialisée par la nouvelle connexion'
+
+    cached = lambda token: server.response_cache.get(token, 'discussions', {}) is not server.ResponseCache.MISSING
+    for token in (first, second):
+        hug.test.call('GET', server, '/discussions', params={'token': token}, headers=get_headers)
+    assert cached(first) and cached(second), '/discussions non mis en cache'
+    hug.test.call('POST', server, '/discussion/readState', body={'token': second, 'discussionId': 'd0'}, headers=post_headers)
+    assert not cached(first) and not cached(second), 'cache de /discussions non invalidé pour tous les jetons du client'
+
+def check_events_idle():
+    """Les interrogations de /events ne prolongent pas la session : elle expire toujours client_timeout_threshold après la dernière requête."""
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'events'}, headers=post_headers).data['token']
+    poll = getattr(server, '__poll_events')
+    idle_since = server.saved_clients[token]['last_interaction'] = time.time() - 60
+    poll(token, {})
+    assert server.saved_clients[token]['last_interaction'] == idle_since, 'session prolongée par une interrogation'
+
+    server.saved_clients[token]['last_interaction'] = time.time() - server.client_timeout_threshold - 1
+    poll(token, {})
+    assert token not in server.saved_clients, 'session expirée gardée par une interrogation'
+
+    # une session supprimée par le nettoyeur termine aussi ses flux, sans attendre leur prochaine interrogation
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'events-nettoyeur'}, headers=post_headers).data['token']
+    stream = server.EventStream(token)
+    with server.event_scheduler.condition:
+        server.event_scheduler.sessions[token] = {'streams': {stream}, 'cursors': {}, 'interval': server.events_max_interval}
+    server.__dict__['__drop_session'](token, 'expired')
+    assert stream.closed and b'event: expired' in stream.read(), 'flux de la session supprimée non terminé'
+
+def check_reaper_unlocked():
+    """Le nettoyeur ferme les clients des sessions expirées sans garder sessions_lock : les connexions ne l'attendent pas."""
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'nettoyeur'}, headers=post_headers).data['token']
+    server.saved_clients[token]['last_interaction'] = expired = time.time() - server.client_timeout_threshold - 1
+    with server.sessions_lock:
+        heapq.heappush(server.sessions_expiry, (expired + server.client_timeout_threshold, token))
+    close_client = server.__dict__['__close_client']
+    lock_free = []
+    def check_lock(client):
+        # depuis un autre thread : le verrou est réentrant pour le thread du nettoyeur
+        thread = threading.Thread(target=lambda: lock_free.append(server.sessions_lock.acquire(timeout=1) and server.sessions_lock.release() is None))
+        thread.start()
+        thread.join()
+        close_client(client)
+    server.__dict__['__close_client'] = check_lock
+    try:
+        server.__dict__['__reap_sessions']()
+    finally:
+        server.__dict__['__close_client'] = close_client
+    assert token not in server.saved_clients, 'session expirée non supprimée'
+    assert lock_free and all(lock_free), 'client fermé avec sessions_lock acquis'
+
+def check_compressed_cache():
+    """Seules les réponses servies depuis le cache des réponses sont gardées compressées."""
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'compression'}, headers=post_headers).data['token']
+    # hug.test décoderait le corps compressé comme du JSON : requêtes directes à l'application falcon
+    app = hug.API(server).http.server()
+    get = lambda url, **params: falcon.testing.simulate_request(app, 'GET', url, params=params, headers={**get_headers, 'Accept-Encoding': 'gzip'})
+    kept = lambda: len(server.compressed_responses.entries)
+
+    before = kept()
+    assert get('/infos').headers.get('content-encoding') == 'gzip', '/infos non compressée'
+    assert kept() == before, 'réponse hors cache gardée compressée'
+
+    assert get('/news', token=token).headers.get('content-encoding') == 'gzip', '/news non compressée'
+    assert kept() == before + 1, 'réponse du cache non gardée compressée'
+
+def check_batch_headers():
+    """Chaque résultat de /batch garde les en-têtes de sa route : X-Sync-Cursor, et l'ETag de la même requête GET."""
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'batch'}, headers=post_headers).data['token']
+    results = hug.test.call('POST', server, '/batch', body={'token': token, 'requests': [{'endpoint': 'news'}, {'endpoint': 'inconnue'}]}, headers=post_headers).data
+    news, unknown = results
+    direct = hug.test.call('GET', server, '/news', params={'token': token}, headers=get_headers)
+    assert news['headers'].get('X-Sync-Cursor'), f'X-Sync-Cursor absent : {news["headers"]}'
+    assert news['headers'].get('ETag') == direct.headers_dict['etag'], 'ETag différent de celui de /news'
+    assert unknown['status'] == 404 and unknown['headers'] == {}, f'résultat inattendu : {unknown}'
+
+    # des params qui ne sont pas un objet font échouer leur sous-requête seulement
+    response = hug.test.call('POST', server, '/batch', body={'token': token, 'requests': [{'endpoint': 'news', 'params': 'abc'}, {'endpoint': 'news', 'params': [1, 2]}, {'endpoint': 'user'}]}, headers=post_headers)
+    assert response.status == '200 OK', f'/batch en échec : {response.status}'
+    assert [result['status'] for result in response.data] == [400, 400, 200], f'statuts inattendus : {response.data}'
+
+def check_sync_bounded():
+    """Les dernières réponses gardées pour since (sync_latest) sont bornées comme les curseurs, même avec une portée par plage de dates."""
+    token = hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'sync-borne'}, headers=post_headers).data['token']
+    for day in range(server.sync_cursors_max + 8):
+        dateFrom = start_day + datetime.timedelta(days=day)
+        hug.test.call('GET', server, '/homework', params={'token': token, 'dateFrom': f'{dateFrom}', 'dateTo': f'{dateFrom + datetime.timedelta(days=6)}'}, headers=get_headers)
+    state = server.__dict__['__client_state'](server.saved_clients[token]['client'])
+    assert len(state['sync']) <= server.sync_cursors_max, f'{len(state["sync"])} curseurs gardés'
+    assert len(state['sync_latest']) <= server.sync_cursors_max, f'{len(state["sync_latest"])} réponses gardées dans sync_latest'
+
+def check_login_wait_metric():
+    """/metrics expose l'histogramme du temps d'attente des connexions dans la file."""
+    count = lambda: sum(int(line.rsplit(' ', 1)[1]) for line in hug.test.call('GET', server, '/metrics').data.splitlines() if line.startswith('papillon_login_queue_wait_seconds_count'))
+    before = count()
+    hug.test.call('POST', server, '/generatetoken', body={**login, 'username': 'attente'}, headers=post_headers)
+    assert count() == before + 1, "attente de la connexion non mesurée"
+
+checks = [check_prefetch, check_projections, check_homework_since, check_shared_client, check_events_idle, check_reaper_unlocked, check_compressed_cache, check_sync_bounded, check_login_wait_metric, check_batch_headers]
+
+def run_checks():
+    """Fait les vérifications et retourne le nombre d'échecs."""
+    failures = 0
+    for check in checks:
+        try:
+            check()
+            print(f'{check.__name__:<30} ok')
+        except AssertionError as e:
+            failures += 1
+            print(f'{check.__name__:<30} ÉCHEC : {e}')
+    return failures
+
+def percentile(sortedValues, p):
+    """Percentile par rang le plus proche."""
+    index = max(0, min(len(sortedValues) - 1, round(p / 100 * len(sortedValues) + 0.5) - 1))
+    return sortedValues[index]
+
+def server_duration(response):
+    """Retourne la durée totale en ms mesurée par le serveur, dans l'en-tête Server-Timing."""
+    return float(re.search(r'total;dur=([0-9.]+)', response.headers_dict['server-timing']).group(1))
+
+def run_endpoint(client, token, name, method, route, params, requests, warmup, cold):
+    """Appelle une route requests fois (après warmup appels non mesurés) et retourne ses mesures."""
+    latencies = []
+    errors = 0
+    total = 0.0
+    gc.collect()
+    for i in range(warmup + requests):
+        if cold:
+            # sans les réponses gardées en cache ni l'état du client (notes, vie scolaire, annuaire...)
+            server.response_cache.invalidate(token)
+            server.client_states.pop(client, None)
+        if route == '/generatetoken':
+            response = hug.test.call('POST', server, route, body=params(i if cold else 0), headers=post_headers)
+        elif method == 'POST':
+            response = hug.test.call('POST', server, route, body=params(i), headers=post_headers, params={'token': token})
+        else:
+            response = hug.test.call('GET', server, route, headers=get_headers, params={'token': token, **params(i)})
+
+        if i < warmup:
+            continue
+        elapsed = server_duration(response)
+        total += elapsed
+        latencies.append(elapsed)
+        if not str(response.status).startswith('2'):
+            errors += 1
+
+    latencies.sort()
+    return {
+        'name': name,
+        'method': method,
+        'route': route,
+        'mode': 'cold' if cold else 'warm',
+        'requests': requests,
+        'errors': errors,
+        'throughput': requests / total * 1000 if total else 0.0,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1],
+        },
+    }
+
+def compare(results, parameters, previousPath, threshold):
+    """Compare le p50 de chaque mesure à celui d'un fichier de résultats précédent. Retourne le nombre de régressions."""
+    with open(previousPath, encoding='utf8') as file:
+        previousReport = json.load(file)
+    previous = {(result['name'], result['mode']): result for result in previousReport['results']}
+
+    print(f"\nComparaison avec {previousPath} (version {previousReport['version']}, p50, régression au-delà de +{threshold:.0f} %)")
+    different = [name for name in sizes if previousReport['parameters'].get(name) != parameters[name]]
+    if different:
+        print(f"Attention : les données n'ont pas la même taille ({', '.join(different)}), les mesures ne sont pas comparables")
+    regressions = 0
+    for result in results:
+        before = previous.get((result['name'], result['mode']))
+        if before is None:
+            continue
+        old, new = before['latency_ms']['p50'], result['latency_ms']['p50']
+        change = (new - old) / old * 100 if old else 0.0
+        regressed = change > threshold
+        regressions += regressed
+        print(f"{result['name']:<30} {result['mode']:<5} {old:9.2f} ms -> {new:9.2f} ms  {change:+7.1f} %{'  RÉGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Banc d\'essai hors ligne de papillon-python, avec un faux client Pronote.')
+    for name, (default, help) in sizes.items():
+        parser.add_argument(f'--{name}', type=int, default=default, help=help)
+    parser.add_argument('--requests', type=int, default=50, help='requêtes mesurées par route et par mode')
+    parser.add_argument('--warmup', type=int, default=5, help='requêtes non mesurées avant chaque série')
+    parser.add_argument('--mode', choices=['warm', 'cold', 'both'], default='both', help='avec le cache des réponses (warm), sans (cold), ou les deux')
+    parser.add_argument('--only', help='noms des routes à mesurer, séparés par des virgules (ex: grades,news)')
+    parser.add_argument('--output', default='bench_results.json', help='fichier JSON où enregistrer les résultats')
+    parser.add_argument('--compare', help='fichier JSON de résultats précédents à comparer')
+    parser.add_argument('--checks-only', action='store_true', help='faire seulement les vérifications, sans les mesures')
+    parser.add_argument('--threshold', type=float, default=20, help='hausse du p50 en %% au-delà de laquelle --compare signale une régression')
+    args = parser.parse_args()
+
+    print('Banc d\'essai papillon-python')
+    print('orjson :', 'oui' if server.orjson is not None else 'non (pip3 install orjson)')
+
+    token = 'bench'
+    dataSizes = make_sizes(**{name: getattr(args, name) for name in sizes})
+    client = install_client(server, dataSizes, token)
+    modes = [False, True] if args.mode == 'both' else [args.mode == 'cold']
+    only = {name.strip() for name in args.only.split(',')} if args.only else None
+
+    # /generatetoken se connecte avec le faux client, sans passer par Pronote
+    realClient = pronotepy.Client
+    pronotepy.Client = lambda *clientArgs, **clientKwargs: FakeClient(dataSizes)
+    server.timing_log_threshold = None
+    server.server_timing = True
+
+    results = []
+    try:
+        failed = run_checks()
+        if args.checks_only:
+            return 1 if failed else 0
+
+        print(f"\n{'route':<30} {'mode':<5} {'req/s':>9} {'moy':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+        for name, method, route, params in endpoints:
+            if only is not None and name.split(' ')[0] not in only:
+                continue
+            for cold in modes:
+                result = run_endpoint(client, token, name, method, route, params, args.requests, args.warmup, cold)
+                results.append(result)
+                latency = result['latency_ms']
+                errors = f"  {result['errors']} erreurs" if result['errors'] else ''
+                print(f"{name:<30} {result['mode']:<5} {result['throughput']:9.1f} {latency['mean']:9.2f} {latency['p50']:9.2f} {latency['p90']:9.2f} {latency['p99']:9.2f} {latency['max']:9.2f}{errors}")
+    finally:
+        pronotepy.Client = realClient
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'VERSION'), encoding='utf8') as file:
+        version = file.read().strip()
+    report = {
+        'version': version,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'orjson': server.orjson is not None,
+        'parameters': {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'threshold')},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f'\nRésultats enregistrés dans {args.output}')
+
+    failed += sum(result['errors'] for result in results)
+    if args.compare:
+        failed += compare(results, report['parameters'], args.compare, args.threshold)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())